@@ -1,4 +1,4 @@
-import ast, copy, pickle
+import ast, copy, functools, pickle
 from .tools import log
 from .namesets import *
 from .display import printFunction
@@ -11,8 +11,16 @@ def cmp(a, b):
 def tree_to_str(a):
 	return repr(pickle.dumps(a))
 
+TREE_CACHE_SIZE = 2000 # how many decoded tree sources to keep
+
+@functools.lru_cache(maxsize=TREE_CACHE_SIZE)
+def treeBytes(s):
+	return eval(s)
+
 def str_to_tree(s):
-	return pickle.loads(eval(s))
+	"""Every call gets a new tree, since trees are modified in place; only the parse
+		of the source string is shared between calls"""
+	return pickle.loads(treeBytes(s))
 
 def builtInName(id):
 	"""Determines whether the given id is a built-in name"""
@@ -848,6 +856,64 @@ def depthOfAST(a):
 			m = tmp
 	return m + 1
 
+# The attributes compareASTs looks at for each type of node
+COMPARE_ATTRS = { ast.Module : ["body"], ast.Interactive : ["body"],
+			ast.Expression : ["body"], ast.Suite : ["body"],
+
+			ast.FunctionDef : ["name", "args", "body", "decorator_list", "returns"],
+			ast.ClassDef : ["name", "bases", "keywords", "body", "decorator_list"],
+			ast.Return : ["value"],
+			ast.Delete : ["targets"],
+			ast.Assign : ["targets", "value"],
+			ast.AugAssign : ["target", "op", "value"],
+			ast.For : ["target", "iter", "body", "orelse"],
+			ast.While : ["test", "body", "orelse"],
+			ast.If : ["test", "body", "orelse"],
+			ast.With : ["items", "body"],
+			ast.Raise : ["exc", "cause"],
+			ast.Try : ["body", "handlers", "orelse", "finalbody"],
+			ast.Assert : ["test", "msg"],
+			ast.Import : ["names"],
+			ast.ImportFrom : ["module", "names", "level"],
+			ast.Global : ["names"],
+			ast.Expr : ["value"],
+
+			ast.BoolOp : ["op", "values"],
+			ast.BinOp : ["left", "op", "right"],
+			ast.UnaryOp : ["op", "operand"],
+			ast.Lambda : ["args", "body"],
+			ast.IfExp : ["test", "body", "orelse"],
+			ast.Dict : ["keys", "values"],
+			ast.Set : ["elts"],
+			ast.ListComp : ["elt", "generators"],
+			ast.SetComp : ["elt", "generators"],
+			ast.DictComp : ["key", "value", "generators"],
+			ast.GeneratorExp : ["elt", "generators"],
+			ast.Yield : ["value"],
+			ast.Compare : ["left", "ops", "comparators"],
+			ast.Call : ["func", "args", "keywords"],
+			ast.Num : ["n"],
+			ast.Str : ["s"],
+			ast.Bytes : ["s"],
+			ast.NameConstant : ["value"],
+			ast.Attribute : ["value", "attr"],
+			ast.Subscript : ["value", "slice"],
+			ast.List : ["elts"],
+			ast.Tuple : ["elts"],
+			ast.Starred : ["value"],
+
+			ast.Slice : ["lower", "upper", "step"],
+			ast.ExtSlice : ["dims"],
+			ast.Index : ["value"],
+
+			ast.comprehension : ["target", "iter", "ifs"],
+			ast.ExceptHandler : ["type", "name", "body"],
+			ast.arguments : ["args", "vararg", "kwonlyargs", "kw_defaults", "kwarg", "defaults"],
+			ast.arg : ["arg", "annotation"],
+			ast.keyword : ["arg", "value"],
+			ast.alias : ["name", "asname"],
+			ast.withitem : ["context_expr", "optional_vars"] }
+
 def compareASTs(a, b, checkEquality=False):
 	"""A comparison function for ASTs"""
 	# None before others
@@ -948,70 +1014,32 @@ def compareASTs(a, b, checkEquality=False):
 		return 0
 
 	# Now compare based on the attributes in the identical types
-	attrMap = { ast.Module : ["body"], ast.Interactive : ["body"],
-				ast.Expression : ["body"], ast.Suite : ["body"],
-
-				ast.FunctionDef : ["name", "args", "body", "decorator_list", "returns"],
-				ast.ClassDef : ["name", "bases", "keywords", "body", "decorator_list"],
-				ast.Return : ["value"],
-				ast.Delete : ["targets"],
-				ast.Assign : ["targets", "value"],
-				ast.AugAssign : ["target", "op", "value"],
-				ast.For : ["target", "iter", "body", "orelse"],
-				ast.While : ["test", "body", "orelse"],
-				ast.If : ["test", "body", "orelse"],
-				ast.With : ["items", "body"],
-				ast.Raise : ["exc", "cause"],
-				ast.Try : ["body", "handlers", "orelse", "finalbody"],
-				ast.Assert : ["test", "msg"],
-				ast.Import : ["names"],
-				ast.ImportFrom : ["module", "names", "level"],
-				ast.Global : ["names"],
-				ast.Expr : ["value"],
-
-				ast.BoolOp : ["op", "values"],
-				ast.BinOp : ["left", "op", "right"],
-				ast.UnaryOp : ["op", "operand"],
-				ast.Lambda : ["args", "body"],
-				ast.IfExp : ["test", "body", "orelse"],
-				ast.Dict : ["keys", "values"],
-				ast.Set : ["elts"],
-				ast.ListComp : ["elt", "generators"],
-				ast.SetComp : ["elt", "generators"],
-				ast.DictComp : ["key", "value", "generators"],
-				ast.GeneratorExp : ["elt", "generators"],
-				ast.Yield : ["value"],
-				ast.Compare : ["left", "ops", "comparators"],
-				ast.Call : ["func", "args", "keywords"],
-				ast.Num : ["n"],
-				ast.Str : ["s"],
-				ast.Bytes : ["s"],
-				ast.NameConstant : ["value"],
-				ast.Attribute : ["value", "attr"],
-				ast.Subscript : ["value", "slice"],
-				ast.List : ["elts"],
-				ast.Tuple : ["elts"],
-				ast.Starred : ["value"],
-
-				ast.Slice : ["lower", "upper", "step"],
-				ast.ExtSlice : ["dims"],
-				ast.Index : ["value"],
-
-				ast.comprehension : ["target", "iter", "ifs"],
-				ast.ExceptHandler : ["type", "name", "body"],
-				ast.arguments : ["args", "vararg", "kwonlyargs", "kw_defaults", "kwarg", "defaults"],
-				ast.arg : ["arg", "annotation"],
-				ast.keyword : ["arg", "value"],
-				ast.alias : ["name", "asname"],
-				ast.withitem : ["context_expr", "optional_vars"] }
-
-	for attr in attrMap[type(a)]:
+	for attr in COMPARE_ATTRS[type(a)]:
 		r = compareASTs(getattr(a, attr), getattr(b, attr), checkEquality=checkEquality)
 		if r != 0:
 			return r
 	# If all attributes are identical, they're equal
 	return 0
 
+contextTypes = (ast.Load, ast.Store, ast.Del, ast.AugLoad, ast.AugStore, ast.Param)
+
+def structureKey(a):
+	"""A hashable key for the tree: two trees have equal keys exactly when
+		compareASTs(a, b, checkEquality=True) == 0, but a key can be kept and compared later
+		without holding a copy of the tree"""
+	if a == None:
+		return None
+	elif type(a) == list:
+		return tuple(structureKey(x) for x in a)
+	elif not isinstance(a, ast.AST):
+		return (type(a), a)
+	elif isinstance(a, contextTypes):
+		return "ctx" # compareASTs doesn't tell contexts apart
+	elif type(a) == ast.Name:
+		return (ast.Name, a.id)
+	attrs = COMPARE_ATTRS.get(type(a), a._fields)
+	return (type(a),) + tuple(structureKey(getattr(a, attr, None)) for attr in attrs)
+
 def deepcopyList(l):
 	"""Deepcopy of a list"""
 	if l == None:
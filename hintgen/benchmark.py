@@ -0,0 +1,161 @@
+"""Replays recorded submissions through do_hint_chain to check that a change doesn't make hints
+worse or slower. Each problem runs in its own process against its own fresh test database,
+seeded with a copy of the problem, its test cases and its instructor solution, so problems
+can run in parallel without sharing (or touching) the real solution spaces. The result is a
+JSON report of chain outcomes, steps, edit weights and latency percentiles per problem."""
+import json, math, multiprocessing, queue, time, traceback
+from django.db import connection
+from .getHint import do_hint_chain, get_hint
+from .models import Student, Problem, State, SourceState
+from .tools import parse_table
+
+DATA_PATH = "hintgen/combined_data/" # where the recorded <problem>.csv files live
+POLL_TIME = 1.0 # seconds between checks on the problem processes
+
+def copyRow(obj):
+	"""An unsaved copy of the model object with the same field values, including the id"""
+	return type(obj)(**{ f.attname : getattr(obj, f.attname) for f in obj._meta.concrete_fields })
+
+def percentile(values, p):
+	"""Nearest-rank percentile of a list of numbers"""
+	if len(values) == 0:
+		return None
+	values = sorted(values)
+	return values[max(0, int(math.ceil(p / 100.0 * len(values))) - 1)]
+
+def summarize(values):
+	if len(values) == 0:
+		return { "mean" : None, "max" : None }
+	return { "mean" : sum(values) / len(values), "max" : max(values) }
+
+def problemReport(name, rows):
+	outcomes = { }
+	for row in rows:
+		outcomes[row["result"]] = outcomes.get(row["result"], 0) + 1
+	latencies = [row["seconds"] for row in rows]
+	return { "problem" : name, "submissions" : len(rows), "outcomes" : outcomes,
+			 "steps" : summarize([row["steps"] for row in rows]),
+			 "syntax_edits" : summarize([row["syntax_edits"] for row in rows]),
+			 "semantic_edits" : summarize([row["semantic_edits"] for row in rows]),
+			 "latency" : { "p50" : percentile(latencies, 50), "p95" : percentile(latencies, 95),
+						   "p99" : percentile(latencies, 99), "max" : max(latencies) if len(latencies) > 0 else None },
+			 "rows" : rows }
+
+def isolateProblem(name):
+	"""Switches this process to a fresh test database holding only the named problem. Also returns
+		the real database's name, which restoreDatabase needs to switch back."""
+	problem = Problem.objects.get(name=name)
+	admin = Student.objects.get(id=1) # the instructor, as in clear_solution_space
+	courses = list(problem.courses.all())
+	course_ids = [c.id for c in courses]
+	if admin.course_id not in course_ids:
+		courses.append(admin.course)
+	tests = list(problem.tests.all())
+	first = State.objects.filter(problem=problem).first()
+	starter_code = first.code if first != None else None
+
+	settings_dict = connection.settings_dict
+	realName = settings_dict["NAME"]
+	if connection.vendor != "sqlite": # sqlite test databases are in memory, so they're already private
+		settings_dict["TEST"]["NAME"] = "test_hintbench_" + name
+	connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+	try:
+		problem = copyRow(problem)
+		problem.space_version = 0
+		problem.save(force_insert=True)
+		for course in courses:
+			copyRow(course).save(force_insert=True)
+		problem.courses.add(*course_ids)
+		for t in tests:
+			copyRow(t).save(force_insert=True)
+		admin = copyRow(admin)
+		admin.save(force_insert=True)
+		if starter_code != None:
+			get_hint(SourceState(code=starter_code, problem=problem, count=1, student=admin))
+	except:
+		restoreDatabase(realName)
+		raise
+	return problem, admin, realName
+
+def restoreDatabase(realName):
+	"""Drops the test database isolateProblem made and switches back to the real one. A process
+		that dies before getting here leaves its database behind, until the next run clobbers it."""
+	connection.creation.destroy_test_db(realName, verbosity=0)
+
+def replayProblem(name, dataPath, limit):
+	"""Runs every recorded submission to the problem through a hint chain. Returns the rows."""
+	problem, admin, realName = isolateProblem(name)
+	try:
+		table = parse_table(dataPath + name + ".csv")
+		header = table[0]
+		rows = []
+		students = { }
+		for line in table[1:]:
+			if line[0] == "0": # instructor solutions
+				continue
+			if limit != None and len(rows) >= limit:
+				break
+			student_name = line[header.index("student_id")]
+			if student_name not in students:
+				students[student_name] = Student(course_id=admin.course_id, name=student_name)
+				students[student_name].save()
+			start_time = time.time()
+			result, step_count, syntax_edits, semantic_edits, start_state, goal_state = \
+				do_hint_chain(line[header.index("fun")], students[student_name], problem)
+			rows.append({ "id" : line[header.index("id")], "start_score" : start_state.score,
+						  "seconds" : time.time() - start_time, "result" : result, "steps" : step_count,
+						  "syntax_edits" : syntax_edits, "semantic_edits" : semantic_edits })
+	finally:
+		restoreDatabase(realName)
+	return rows
+
+def problemMain(name, dataPath, limit, results):
+	try:
+		results.put(problemReport(name, replayProblem(name, dataPath, limit)))
+	except Exception as e:
+		results.put({ "problem" : name, "error" : traceback.format_exc() })
+
+def runBenchmark(problems, dataPath=DATA_PATH, processes=1, limit=None):
+	"""Replays each problem in its own process, at most processes at a time, and returns the report"""
+	connection.close() # the children each need their own connection
+	results = multiprocessing.Queue()
+	waiting = list(problems)
+	running = [] # (problem name, process) pairs
+	reports = { }
+	start = time.time()
+	while len(waiting) > 0 or len(running) > 0:
+		while len(waiting) > 0 and len(running) < processes:
+			# Not a daemon, since the test harness forks its own sandbox processes
+			proc = multiprocessing.Process(target=problemMain, args=(waiting[0], dataPath, limit, results))
+			proc.start()
+			running.append((waiting.pop(0), proc))
+		try:
+			report = results.get(timeout=POLL_TIME)
+			reports[report["problem"]] = report
+		except queue.Empty:
+			pass
+		for (name, proc) in running:
+			if not proc.is_alive():
+				proc.join()
+		running = [(name, proc) for (name, proc) in running if proc.exitcode == None]
+	# A process that died before reporting has left nothing in the queue
+	for name in problems:
+		if name not in reports:
+			try:
+				report = results.get(timeout=POLL_TIME)
+				reports[report["problem"]] = report
+			except queue.Empty:
+				pass
+		if name not in reports:
+			reports[name] = { "problem" : name, "error" : "Benchmark process died" }
+	totals = { }
+	for report in reports.values():
+		for (result, count) in report.get("outcomes", { }).items():
+			totals[result] = totals.get(result, 0) + count
+	return { "seconds" : time.time() - start, "outcomes" : totals,
+			 "problems" : [reports[name] for name in problems] }
+
+def writeReport(report, filename):
+	with open(filename, "w") as f:
+		json.dump(report, f, indent=1, sort_keys=True)
@@ -0,0 +1,119 @@
+"""Canonical forms of anonymized trees, shared by every submission with the same structure.
+Canonicalizing only depends on the anonymized tree and the problem, but the canonical tree
+also points back into the submission's own tree (global ids, original names and locations),
+which mapEdit needs. So each entry keeps the canonical tree with those references replaced
+by positions in the submission's tree, and a hit fills them in from the new submission."""
+import ast, collections, pickle, threading
+from .astTools import structureKey
+from .canonicalize import getCanonicalForm
+
+CANONICAL_CACHE_SIZE = 5000 # how many canonical forms to keep
+ID_PROPERTIES = ["global_id", "second_global_id", "variableGlobalId", "moved_line"] # metadata that holds a global id
+
+canonical_forms = collections.OrderedDict() # key -> CanonicalForm, oldest first
+canonical_forms_lock = threading.Lock()
+
+def canonical_key(s, given_names, argTypes, imports, anon_tree):
+	return (s.problem.name, repr(argTypes), tuple(given_names or []), structureKey(imports),
+			structureKey(anon_tree))
+
+NAME_FIELDS = { ast.Name : "id", ast.arg : "arg", ast.FunctionDef : "name", ast.ClassDef : "name" }
+
+def nameMap(orig_tree, anon_tree):
+	"""Maps each anonymized name to the name it replaced, or returns None if the trees don't line up"""
+	names = { }
+	for (orig, anon) in zip(ast.walk(orig_tree), ast.walk(anon_tree)):
+		if type(orig) != type(anon):
+			return None
+		if type(orig) in NAME_FIELDS:
+			field = NAME_FIELDS[type(orig)]
+			if names.setdefault(getattr(anon, field), getattr(orig, field)) != getattr(orig, field):
+				return None
+	return names
+
+def idNodes(orig_tree):
+	"""The nodes of the tree that have global ids, in a fixed order"""
+	return [node for node in ast.walk(orig_tree) if hasattr(node, "global_id")]
+
+class CanonicalForm:
+	def __init__(self, canonical_tree, code, orig_tree, names):
+		"""Raises KeyError if the canonical tree refers to something that can't be found again"""
+		origNodes = idNodes(orig_tree)
+		positions = { node.global_id : i for (i, node) in enumerate(origNodes) }
+		allNodes = list(ast.walk(orig_tree))
+		indexes = { id(node) : i for (i, node) in enumerate(allNodes) }
+		locations = { }
+		for (i, node) in enumerate(allNodes):
+			if hasattr(node, "lineno"):
+				locations.setdefault((node.lineno, node.col_offset), i)
+		anonNames = { }
+		for (anon, orig) in names.items():
+			anonNames.setdefault(orig, []).append(anon)
+
+		template = pickle.loads(pickle.dumps(canonical_tree))
+		for node in ast.walk(template):
+			if hasattr(node, "lineno"):
+				# Take the location from the node's own original if it came from there,
+				# and otherwise from the first node at the same place
+				orig = origNodes[positions[node.global_id]] if getattr(node, "global_id", None) in positions else None
+				if orig != None and (getattr(orig, "lineno", None), getattr(orig, "col_offset", None)) == (node.lineno, node.col_offset):
+					node.cachedLocation = indexes[id(orig)]
+				elif (node.lineno, node.col_offset) in locations:
+					node.cachedLocation = locations[(node.lineno, node.col_offset)]
+			for prop in ID_PROPERTIES:
+				if getattr(node, prop, None) != None:
+					setattr(node, prop, ("position", positions[getattr(node, prop)]))
+			if hasattr(node, "originalId") and node.originalId in anonNames:
+				if len(anonNames[node.originalId]) > 1:
+					raise KeyError(node.originalId) # the name can't be told apart in other trees
+				node.originalId = ("anon", anonNames[node.originalId][0])
+		self.template = pickle.dumps(template)
+		self.code = code
+
+	def apply(self, orig_tree, names):
+		"""A new canonical tree pointing into the given tree. Raises KeyError if it doesn't fit."""
+		origNodes = idNodes(orig_tree)
+		allNodes = list(ast.walk(orig_tree))
+		tree = pickle.loads(self.template)
+		for node in ast.walk(tree):
+			for prop in ID_PROPERTIES:
+				if type(getattr(node, prop, None)) == tuple:
+					setattr(node, prop, origNodes[getattr(node, prop)[1]].global_id)
+			if type(getattr(node, "originalId", None)) == tuple:
+				node.originalId = names[node.originalId[1]]
+			if hasattr(node, "cachedLocation"):
+				node.lineno = allNodes[node.cachedLocation].lineno
+				node.col_offset = allNodes[node.cachedLocation].col_offset
+				del node.cachedLocation
+		return tree
+
+def cachedCanonicalForm(s, given_names, argTypes, imports, anon_tree):
+	"""getCanonicalForm, reusing the result for any earlier tree with the same anonymized structure.
+		s.orig_tree must be set, with ids given, and s.tree a copy of it."""
+	names = nameMap(s.orig_tree, anon_tree)
+	if names == None:
+		return getCanonicalForm(s, given_names, argTypes, imports)
+	key = canonical_key(s, given_names, argTypes, imports, anon_tree)
+	with canonical_forms_lock:
+		entry = canonical_forms.get(key)
+		if entry != None:
+			canonical_forms.move_to_end(key)
+	if entry != None:
+		try:
+			s.tree = entry.apply(s.orig_tree, names)
+			s.code = entry.code
+			return s
+		except (KeyError, IndexError):
+			pass # this tree's names can't be mapped, so work it out again
+
+	s = getCanonicalForm(s, given_names, argTypes, imports)
+	try:
+		entry = CanonicalForm(s.tree, s.code, s.orig_tree, names)
+	except KeyError:
+		return s
+	with canonical_forms_lock:
+		canonical_forms[key] = entry
+		canonical_forms.move_to_end(key)
+		while len(canonical_forms) > CANONICAL_CACHE_SIZE:
+			canonical_forms.popitem(last=False)
+	return s
@@ -1,24 +1,30 @@
-import ast, copy, uuid
+import ast, copy, itertools, random
 from .transformations import *
 from ..namesets import allPythonFunctions
 from ..display import printFunction
 from ..test import test
-from ..astTools import tree_to_str, deepcopy
+from ..astTools import tree_to_str, deepcopy, structureKey
 from ..tools import log
 
+# Each tree's nodes are numbered from a fresh block of ids. The block is picked at random so
+# that ids from trees made by other processes (like the goal states) won't collide.
+TREE_ID_BITS = 44
+NODE_ID_BITS = 20 # trees never come close to 2**20 nodes
+idSource = random.SystemRandom() # not seeded, so forked processes don't share blocks
+
+def newIdBlock():
+	return idSource.getrandbits(TREE_ID_BITS) << NODE_ID_BITS
+
 def runGiveIds(a):
-	global idCounter
-	idCounter = 0
-	giveIds(a)
+	giveIds(a, itertools.count(newIdBlock()))
 
-idCounter = 0
-def giveIds(a):
-	global idCounter
+def giveIds(a, ids):
+	"""Numbers the tree's nodes in order from ids. Each tree gets its own counter, so trees
+		numbered at the same time (in other threads) don't take ids from each other's blocks."""
 	if isinstance(a, ast.AST):
 		if type(a) in [ast.Load, ast.Store, ast.Del, ast.AugLoad, ast.AugStore, ast.Param]:
 			return # skip these
-		a.global_id = uuid.uuid1()
-		idCounter += 1
+		a.global_id = next(ids)
 		for field in a._fields:
 			child = getattr(a, field)
 			if type(child) == list:
@@ -26,13 +32,13 @@ def giveIds(a):
 					# Get rid of aliased items
 					if hasattr(child[i], "global_id"):
 						child[i] = copy.deepcopy(child[i])
-					giveIds(child[i])
+					giveIds(child[i], ids)
 			else:
 				# Get rid of aliased items
 				if hasattr(child, "global_id"):
 					child = copy.deepcopy(child)
 					setattr(a, field, child)
-				giveIds(child)
+				giveIds(child, ids)
 
 # def exists(d):
 # 	for k in d:
@@ -176,12 +182,7 @@ def getCanonicalForm(s, given_names=None, argTypes=None, imports=None):
 	transformations = [
 				constantFolding,
 
-				cleanupEquals,
-				cleanupBoolOps,
-				cleanupRanges,
-				cleanupSlices,
-				cleanupTypes,
-				cleanupNegations,
+				cleanup,
 
 				conditionalRedundancy,
 				combineConditionals,
@@ -201,14 +202,18 @@ def getCanonicalForm(s, given_names=None, argTypes=None, imports=None):
 	stateDiff(s, "simplify")
 	s.tree = anonymizeNames(s.tree, given_names, imports)
 	stateDiff(s, "anonymizeNames")
-	oldTree = None
-	while compareASTs(oldTree, s.tree, checkEquality=True) != 0:
-		oldTree = deepcopy(s.tree)
+
+	# Run every pass until a whole round leaves the tree alone
+	oldKey = None
+	key = structureKey(s.tree)
+	while key != oldKey:
+		oldKey = key
 		helperFolding(s.tree, s.problem.name, imports)
 		stateDiff(s, "helperFolding")
 		for t in transformations:
 			s.tree = t(s.tree) # modify in place
-			stateDiff(s, str(t).split()[1])
+			stateDiff(s, t.__name__)
+		key = structureKey(s.tree)
 	s.code = printFunction(s.tree)
 	s.score = orig_score
 	s.feedback = orig_feedback
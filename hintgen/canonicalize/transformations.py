@@ -1218,6 +1218,89 @@ def addPropTag(a, globalId):
 		a.variableGlobalId = globalId
 	return applyToChildren(a, lambda x : addPropTag(x, globalId))
 
+class VariableBits:
+	"""Gives each variable name a bit, so that sets of names can be kept as integers"""
+	def __init__(self):
+		self.positions = { }
+
+	def mask(self, names):
+		m = 0
+		for name in names:
+			if name == None:
+				continue
+			if name not in self.positions:
+				self.positions[name] = len(self.positions)
+			m |= 1 << self.positions[name]
+		return m
+
+class LiveValues:
+	"""The values copyPropagation can put in place of variables. Each value's variables are
+		kept as a bitset, so reassigning a variable finds the values it invalidates without
+		walking every value again."""
+	def __init__(self, bits=None):
+		self.bits = bits if bits != None else VariableBits()
+		self.values = { }
+		self.uses = { } # variable -> bitset of the variables its value uses
+
+	def __contains__(self, name):
+		return name in self.values
+
+	def __getitem__(self, name):
+		return self.values[name]
+
+	def __setitem__(self, name, value):
+		self.values[name] = value
+		self.uses[name] = self.bits.mask(allVariableNamesUsed(value))
+
+	def __delitem__(self, name):
+		del self.values[name]
+		del self.uses[name]
+
+	def __iter__(self):
+		return iter(self.values)
+
+	def __len__(self):
+		return len(self.values)
+
+	def keys(self):
+		return self.values.keys()
+
+	def clear(self):
+		self.values.clear()
+		self.uses.clear()
+
+	def copy(self):
+		"""A copy for a separate branch. The values are shared, since they're only ever copied out."""
+		other = LiveValues(self.bits)
+		other.values = dict(self.values)
+		other.uses = dict(self.uses)
+		return other
+
+	def keepCommon(self, first, second):
+		"""Keep only the values that both branches ended up with"""
+		self.clear()
+		for var in first:
+			if var in second and (first[var] is second[var] or \
+					compareASTs(first[var], second[var], checkEquality=True) == 0):
+				self.values[var] = first.values[var]
+				self.uses[var] = first.uses[var]
+
+	def killUses(self, names):
+		"""Forget every value that uses one of the variables"""
+		mask = self.bits.mask(names)
+		if mask == 0:
+			return
+		for var in list(self.values.keys()):
+			if self.uses[var] & mask:
+				del self[var]
+
+	def kill(self, names):
+		"""Forget the variables, and every value that uses one of them"""
+		for name in names:
+			if name in self.values:
+				del self[name]
+		self.killUses(names)
+
 def propagateValues(a, liveVars):
 	"""Propagate the given values through the AST whenever their variables occur"""
 	if ((not isinstance(a, ast.AST) or len(liveVars.keys()) == 0)):
@@ -1237,15 +1320,7 @@ def propagateValues(a, liveVars):
 		# If something is mutated, it cannot be propagated anymore
 		if isMutatingFunction(a):
 			allVars = allVariablesUsed(a)
-			for var in allVars:
-				if (eventualType(var) not in [int, float, bool, str]):
-					if (var.id in liveVars):
-						del liveVars[var.id]
-					currentLiveVars = list(liveVars.keys())
-					for liveVar in currentLiveVars:
-						varsWithin = allVariableNamesUsed(liveVars[liveVar])
-						if var.id in varsWithin:
-							del liveVars[liveVar]
+			liveVars.kill([var.id for var in allVars if eventualType(var) not in [int, float, bool, str]])
 			return a
 		elif type(a.func) == ast.Name and a.func.id in liveVars and \
 				eventualType(liveVars[a.func.id]) in [int, float, complex, bytes, bool, type(None)]:
@@ -1273,8 +1348,15 @@ def hasMutatingFunction(a):
 
 def clearBlockVars(a, liveVars):
 	"""Clear all the vars set in this block out of the live vars"""
-	if (not isinstance(a, ast.AST)) or len(liveVars.keys()) == 0:
-		return
+	if len(liveVars) > 0:
+		liveVars.kill(blockVars(a))
+
+def blockVars(a, names=None):
+	"""The variables that this block may set or mutate"""
+	if names == None:
+		names = []
+	if not isinstance(a, ast.AST):
+		return names
 
 	if type(a) in [ast.Assign, ast.AugAssign]:
 		if type(a) == ast.Assign:
@@ -1282,35 +1364,20 @@ def clearBlockVars(a, liveVars):
 		else:
 			targets = gatherAssignedVars([a.target])
 		for target in targets:
-			varId = None
 			if type(target) == ast.Name:
-				varId = target.id
+				names.append(target.id)
 			elif type(target.value) == ast.Name:
-				varId = target.value.id
-			if varId in liveVars:
-				del liveVars[varId]
-
-			liveKeys = list(liveVars.keys())
-			for var in liveKeys:
-				# Remove the variable and any variables in which it is used
-				if varId in allVariableNamesUsed(liveVars[var]):
-					del liveVars[var]
-		return
+				names.append(target.value.id)
+		return names
 	elif type(a) == ast.Call:
 		if hasMutatingFunction(a):
 			for v in allVariablesUsed(a):
 				if eventualType(v) not in [int, float, bool, str]:
-					if v.id in liveVars:
-						del liveVars[v.id]
-					liveKeys = list(liveVars.keys())
-					for var in liveKeys:
-						if v.id in allVariableNamesUsed(liveVars[var]):
-							del liveVars[var]
-			return
+					names.append(v.id)
+			return names
 	elif type(a) == ast.For:
-		names = []
 		if type(a.target) == ast.Name:
-			names = [a.target.id]
+			names.append(a.target.id)
 		elif type(a.target) in [ast.Tuple, ast.List]:
 			for elt in a.target.elts:
 				if type(elt) == ast.Name:
@@ -1329,23 +1396,15 @@ def clearBlockVars(a, liveVars):
 				log("transformations\tclearBlockVars\tFor target subscript not a name: " + str(type(a.target.value)), "bug")
 		else:
 			log("transformations\tclearBlockVars\tFor target not a name: " + str(type(a.target)), "bug")
-		for name in names:
-			if name in liveVars:
-				del liveVars[name]
-
-			liveKeys = list(liveVars.keys())
-			for var in liveKeys:
-				# Remove the variable and any variables in which it is used
-				if name in allVariableNamesUsed(liveVars[var]):
-					del liveVars[var]
 
 	for child in ast.iter_child_nodes(a):
-		clearBlockVars(child, liveVars)
+		blockVars(child, names)
+	return names
 
 def copyPropagation(a, liveVars=None, inLoop=False):
 	"""Propagate variables into the tree, when possible"""
 	if liveVars == None:
-		liveVars = { }
+		liveVars = LiveValues()
 	if type(a) == ast.Module:
 		a.body = copyPropagation(a.body)
 		return a
@@ -1358,7 +1417,7 @@ def copyPropagation(a, liveVars=None, inLoop=False):
 		while i < len(a):
 			deleteLine = False
 			if type(a[i]) == ast.FunctionDef:
-				a[i].body = copyPropagation(a[i].body, liveVars=copy.deepcopy(liveVars))
+				a[i].body = copyPropagation(a[i].body, liveVars=liveVars.copy())
 			elif type(a[i]) == ast.ClassDef:
 				# TODO: can we propagate values through everything after here?
 				for j in range(len(a[i].body)):
@@ -1386,11 +1445,8 @@ def copyPropagation(a, liveVars=None, inLoop=False):
 						varId = target.value.id
 
 					# Now, update the live vars based on anything reset by the new target
-					liveKeys = list(liveVars.keys())
-					for var in liveKeys:
-						# If the var we're replacing was used elsewhere, that value will no longer be the same
-						if varId in allVariableNamesUsed(liveVars[var]):
-							del liveVars[var]
+					# If the var we're replacing was used elsewhere, that value will no longer be the same
+					liveVars.killUses([varId])
 				elif type(target) in [ast.Tuple, ast.List]:
 					# Copy the values, if we can match them
 					if type(a[i].value) in [ast.Tuple, ast.List] and len(target.elts) == len(a[i].value.elts):
@@ -1410,11 +1466,7 @@ def copyPropagation(a, liveVars=None, inLoop=False):
 								varId = e.id
 							elif type(e.value) == ast.Name:
 								varId = e.value.id
-
-							liveKeys = list(liveVars.keys())
-							for var in liveKeys:
-								if varId in allVariableNamesUsed(liveVars[var]):
-									del liveVars[var]
+							liveVars.killUses([varId])
 						else:
 							log("transformations\tcopyPropagation\tWeird assign type: " + str(type(e)), "bug")
 			elif type(a[i]) == ast.AugAssign:
@@ -1452,33 +1504,23 @@ def copyPropagation(a, liveVars=None, inLoop=False):
 				else:
 					log("transformations\tcopyPropagation\tFor target not a name: " + str(type(a[i].target)) + "\t" + printFunction(a[i].target), "bug")
 
-				for name in names:
-					liveKeys = list(liveVars.keys())
-					for var in liveKeys:
-						if name in allVariableNamesUsed(liveVars[var]):
-							del liveVars[var]
-					if name in liveVars:
-						del liveVars[name]
+				liveVars.kill(names)
 				clearBlockVars(a[i], liveVars)
-				a[i].body = copyPropagation(a[i].body, copy.deepcopy(liveVars), inLoop=True)
-				a[i].orelse = copyPropagation(a[i].orelse, copy.deepcopy(liveVars), inLoop=True)
+				a[i].body = copyPropagation(a[i].body, liveVars.copy(), inLoop=True)
+				a[i].orelse = copyPropagation(a[i].orelse, liveVars.copy(), inLoop=True)
 			elif type(a[i]) == ast.While:
 				clearBlockVars(a[i], liveVars)
 				a[i].test = propagateValues(a[i].test, liveVars)
-				a[i].body = copyPropagation(a[i].body, copy.deepcopy(liveVars), inLoop=True)
-				a[i].orelse = copyPropagation(a[i].orelse, copy.deepcopy(liveVars), inLoop=True)
+				a[i].body = copyPropagation(a[i].body, liveVars.copy(), inLoop=True)
+				a[i].orelse = copyPropagation(a[i].orelse, liveVars.copy(), inLoop=True)
 			elif type(a[i]) == ast.If:
 				a[i].test = propagateValues(a[i].test, liveVars)
-				liveVars1 = copy.deepcopy(liveVars)
-				liveVars2 = copy.deepcopy(liveVars)
+				liveVars1 = liveVars.copy()
+				liveVars2 = liveVars.copy()
 				a[i].body = copyPropagation(a[i].body, liveVars1)
 				a[i].orelse = copyPropagation(a[i].orelse, liveVars2)
-				liveVars.clear()
 				# We can keep any values that occur in both
-				for key in liveVars1:
-					if key in liveVars2:
-						if compareASTs(liveVars1[key], liveVars2[key], checkEquality=True) == 0:
-							liveVars[key] = liveVars1[key]
+				liveVars.keepCommon(liveVars1, liveVars2)
 			# TODO: think more deeply about how this should work
 			elif type(a[i]) == ast.Try:
 				a[i].body = copyPropagation(a[i].body, liveVars)
@@ -1624,8 +1666,8 @@ def deadCodeRemoval(a, liveVars=None, keepPrints=True, inLoop=False):
 				# We need to make ALL variables in the loop live, since they update continuously
 				liveVars |= set(allVariableNamesUsed(stmt))
 				gid = stmt.body[0].global_id if len(stmt.body) > 0 and hasattr(stmt.body[0], "global_id") else None
-				stmt.body = deadCodeRemoval(stmt.body, copy.deepcopy(liveVars), keepPrints=keepPrints, inLoop=True)
-				stmt.orelse = deadCodeRemoval(stmt.orelse, copy.deepcopy(liveVars), keepPrints=keepPrints, inLoop=inLoop)
+				stmt.body = deadCodeRemoval(stmt.body, set(liveVars), keepPrints=keepPrints, inLoop=True)
+				stmt.orelse = deadCodeRemoval(stmt.orelse, set(liveVars), keepPrints=keepPrints, inLoop=inLoop)
 				# If the body is empty and we don't need the target, get rid of it!
 				if len(stmt.body) == 0:
 					for name in targetNames:
@@ -1656,8 +1698,8 @@ def deadCodeRemoval(a, liveVars=None, keepPrints=True, inLoop=False):
 				# We need to make ALL variables in the loop live, since they update continuously
 				liveVars |= set(allVariableNamesUsed(stmt))
 				old_global_id = stmt.body[0].global_id
-				stmt.body = deadCodeRemoval(stmt.body, copy.deepcopy(liveVars), keepPrints=keepPrints, inLoop=True)
-				stmt.orelse = deadCodeRemoval(stmt.orelse, copy.deepcopy(liveVars), keepPrints=keepPrints, inLoop=inLoop)
+				stmt.body = deadCodeRemoval(stmt.body, set(liveVars), keepPrints=keepPrints, inLoop=True)
+				stmt.orelse = deadCodeRemoval(stmt.orelse, set(liveVars), keepPrints=keepPrints, inLoop=inLoop)
 				# If the body is empty, get rid of it!
 				if len(stmt.body) == 0:
 					stmt.body = [ast.Pass(removedLines=True, global_id=old_global_id)]
@@ -1678,8 +1720,8 @@ def deadCodeRemoval(a, liveVars=None, keepPrints=True, inLoop=False):
 							a[i:i+1] = a[i].orelse
 						continue
 				# For if statements, see if you can shorten things
-				liveVars1 = copy.deepcopy(liveVars)
-				liveVars2 = copy.deepcopy(liveVars)
+				liveVars1 = set(liveVars)
+				liveVars2 = set(liveVars)
 				stmt.body = deadCodeRemoval(stmt.body, liveVars1, keepPrints=keepPrints, inLoop=inLoop)
 				stmt.orelse = deadCodeRemoval(stmt.orelse, liveVars2, keepPrints=keepPrints, inLoop=inLoop)
 				liveVars.clear()
@@ -2205,147 +2247,120 @@ def deMorganize(a):
 
 ##### CLEANUP FUNCTIONS #####
 
-def cleanupEquals(a):
+# Each cleanup below rewrites a single node whose children have already been cleaned up.
+# cleanup runs all of them in one bottom-up walk, using CLEANUP_TABLE to find the ones
+# that apply to each type of node.
+
+def equalsCleanup(a):
 	"""Gets rid of silly blah == True statements that students make"""
-	if not isinstance(a, ast.AST):
+	if type(a.ops[0]) not in [ast.Eq, ast.NotEq]:
 		return a
-	if type(a) == ast.Call:
-		a.func = cleanupEquals(a.func)
-		for i in range(len(a.args)):
-			# But test expressions don't carry through to function arguments
-			a.args[i] = cleanupEquals(a.args[i])
-		return a
-	elif type(a) == ast.Compare and type(a.ops[0]) in [ast.Eq, ast.NotEq]:
-		l = a.left = cleanupEquals(a.left)
-		r = cleanupEquals(a.comparators[0])
-		a.comparators = [r]
-		if type(l) == ast.NameConstant and l.value in [True, False]:
-			(l,r) = (r,l)
-		# If we have (boolean expression) == True
-		if type(r) == ast.NameConstant and r.value in [True, False] and (eventualType(l) == bool):
-			# Matching types
-			if (type(a.ops[0]) == ast.Eq and r.value == True) or \
-				(type(a.ops[0]) == ast.NotEq and r.value == False):
-				transferMetaData(a, l) # make sure to keep the original location
-				return l
-			else:
-				tmp = ast.UnaryOp(ast.Not(addedNotOp=True), l)
-				transferMetaData(a, tmp)
-				return tmp
+	l = a.left
+	r = a.comparators[0]
+	a.comparators = [r]
+	if type(l) == ast.NameConstant and l.value in [True, False]:
+		(l,r) = (r,l)
+	# If we have (boolean expression) == True
+	if type(r) == ast.NameConstant and r.value in [True, False] and (eventualType(l) == bool):
+		# Matching types
+		if (type(a.ops[0]) == ast.Eq and r.value == True) or \
+			(type(a.ops[0]) == ast.NotEq and r.value == False):
+			transferMetaData(a, l) # make sure to keep the original location
+			return l
 		else:
-			return a
-	else:
-		return applyToChildren(a, cleanupEquals)
+			tmp = ast.UnaryOp(ast.Not(addedNotOp=True), l)
+			transferMetaData(a, tmp)
+			return tmp
+	return a
 
-def cleanupBoolOps(a):
+def boolOpCleanup(a):
 	"""When possible, combine adjacent boolean expressions"""
 	"""Note- we are assuming that all ops are the first op (as is done in the simplify function)"""
-	if not isinstance(a, ast.AST):
-		return a
-	if type(a) == ast.BoolOp:
-		allTypesWork = True
-		for i in range(len(a.values)):
-			a.values[i] = cleanupBoolOps(a.values[i])
-			if eventualType(a.values[i]) != bool or hasattr(a.values[i], "multiComp"):
-				allTypesWork = False
-
+	for value in a.values:
 		# We can't reduce if the types aren't all booleans
-		if not allTypesWork:
+		if eventualType(value) != bool or hasattr(value, "multiComp"):
 			return a
 
-		i = 0
-		while i < len(a.values) - 1:
-			current = a.values[i]
-			next = a.values[i+1]
-			# (a and b and c and d) or (a and e and d) == a and ((b and c) or e) and d
-			if type(current) == type(next) == ast.BoolOp:
-				if type(current.op) == type(next.op):
-					minlength = min(len(current.values), len(next.values)) # shortest length
-
-					# First, check for all identical values from the front
-					j = 0
-					while j < minlength:
-						if compareASTs(current.values[j], next.values[j], checkEquality=True) != 0:
-							break
-						j += 1
+	i = 0
+	while i < len(a.values) - 1:
+		current = a.values[i]
+		next = a.values[i+1]
+		# (a and b and c and d) or (a and e and d) == a and ((b and c) or e) and d
+		if type(current) == type(next) == ast.BoolOp:
+			if type(current.op) == type(next.op):
+				minlength = min(len(current.values), len(next.values)) # shortest length
+
+				# First, check for all identical values from the front
+				j = 0
+				while j < minlength:
+					if compareASTs(current.values[j], next.values[j], checkEquality=True) != 0:
+						break
+					j += 1
 
-					# Same values in both, so get rid of the latter line
-					if j == len(current.values) == len(next.values):
-						a.values.pop(i+1)
-						continue
-			i += 1
-		### If reduced to one item, just return that item
-		return a.values[0] if (len(a.values) == 1) else a
-	return applyToChildren(a, cleanupBoolOps)
+				# Same values in both, so get rid of the latter line
+				if j == len(current.values) == len(next.values):
+					a.values.pop(i+1)
+					continue
+		i += 1
+	### If reduced to one item, just return that item
+	return a.values[0] if (len(a.values) == 1) else a
 
-def cleanupRanges(a):
+def rangeCleanup(a):
 	"""Remove any range shenanigans, because Python lets you include unneccessary values"""
-	if not isinstance(a, ast.AST):
-		return a
-	if type(a) == ast.Call:
-		if type(a.func) == ast.Name:
-			if a.func.id in ["range"]:
-				if len(a.args) == 3:
-					# The step defaults to 1!
-					if type(a.args[2]) == ast.Num and a.args[2].n == 1:
-						a.args = a.args[:-1]
-				if len(a.args) == 2:
-					# The start defaults to 0!
-					if type(a.args[0]) == ast.Num and a.args[0].n == 0:
-						a.args = a.args[1:]
-	return applyToChildren(a, cleanupRanges)
-
-def cleanupSlices(a):
+	if type(a.func) == ast.Name:
+		if a.func.id in ["range"]:
+			if len(a.args) == 3:
+				# The step defaults to 1!
+				if type(a.args[2]) == ast.Num and a.args[2].n == 1:
+					a.args = a.args[:-1]
+			if len(a.args) == 2:
+				# The start defaults to 0!
+				if type(a.args[0]) == ast.Num and a.args[0].n == 0:
+					a.args = a.args[1:]
+	return a
+
+def sliceCleanup(a):
 	"""Remove any slice shenanigans, because Python lets you include unneccessary values"""
-	if not isinstance(a, ast.AST):
-		return a
-	if type(a) == ast.Subscript:
-		if type(a.slice) == ast.Slice:
-			# Lower defaults to 0
-			if a.slice.lower != None and type(a.slice.lower) == ast.Num and a.slice.lower.n == 0:
-				a.slice.lower = None
-			# Upper defaults to len(value)
-			if a.slice.upper != None and type(a.slice.upper) == ast.Call and \
-				type(a.slice.upper.func) == ast.Name and a.slice.upper.func.id == "len":
-				if compareASTs(a.value, a.slice.upper.args[0], checkEquality=True) == 0:
-					a.slice.upper = None
-			# Step defaults to 1
-			if a.slice.step != None and type(a.slice.step) == ast.Num and a.slice.step.n == 1:
-				a.slice.step = None
-	return applyToChildren(a, cleanupSlices)
-
-def cleanupTypes(a):
+	if type(a.slice) == ast.Slice:
+		# Lower defaults to 0
+		if a.slice.lower != None and type(a.slice.lower) == ast.Num and a.slice.lower.n == 0:
+			a.slice.lower = None
+		# Upper defaults to len(value)
+		if a.slice.upper != None and type(a.slice.upper) == ast.Call and \
+			type(a.slice.upper.func) == ast.Name and a.slice.upper.func.id == "len":
+			if compareASTs(a.value, a.slice.upper.args[0], checkEquality=True) == 0:
+				a.slice.upper = None
+		# Step defaults to 1
+		if a.slice.step != None and type(a.slice.step) == ast.Num and a.slice.step.n == 1:
+			a.slice.step = None
+	return a
+
+def binOpTypeCleanup(a):
+	"""No need to cast something if it'll be changed anyway by a binary operation"""
+	# Ints become floats naturally
+	if eventualType(a.left) == eventualType(a.right) == float:
+		if type(a.right) == ast.Call and type(a.right.func) == ast.Name and \
+			a.right.func.id == "float" and len(a.right.args) == 1 and len(a.right.keywords) == 0 and \
+			eventualType(a.right.args[0]) in [int, float]:
+			a.right = a.right.args[0]
+		elif type(a.left) == ast.Call and type(a.left.func) == ast.Name and \
+			a.left.func.id == "float" and len(a.left.args) == 1 and len(a.left.keywords) == 0 and \
+			eventualType(a.left.args[0]) in [int, float]:
+			a.left = a.left.args[0]
+	return a
+
+def callTypeCleanup(a):
 	"""Remove any unneccessary type mappings"""
-	if not isinstance(a, ast.AST):
-		return a
-	# No need to cast something if it'll be changed anyway by a binary operation
-	if type(a) == ast.BinOp:
-		a.left = cleanupTypes(a.left)
-		a.right = cleanupTypes(a.right)
-		# Ints become floats naturally
-		if eventualType(a.left) == eventualType(a.right) == float:
-			if type(a.right) == ast.Call and type(a.right.func) == ast.Name and \
-				a.right.func.id == "float" and len(a.right.args) == 1 and len(a.right.keywords) == 0 and \
-				eventualType(a.right.args[0]) in [int, float]:
-				a.right = a.right.args[0]
-			elif type(a.left) == ast.Call and type(a.left.func) == ast.Name and \
-				a.left.func.id == "float" and len(a.left.args) == 1 and len(a.left.keywords) == 0 and \
-				eventualType(a.left.args[0]) in [int, float]:
-				a.left = a.left.args[0]
-		return a
-	elif type(a) == ast.Call and type(a.func) == ast.Name and len(a.args) == 1 and len(a.keywords) == 0:
-		a.func = cleanupTypes(a.func)
-		a.args = [cleanupTypes(a.args[0])]
+	if type(a.func) == ast.Name and len(a.args) == 1 and len(a.keywords) == 0:
 		# If the type already matches, no need to cast it
 		funName = a.func.id
 		argType = eventualType(a.args[0])
-		if type(a.func) == ast.Name:
-			if (funName == "float" and argType == float) or \
-				(funName == "int" and argType == int) or \
-				(funName == "bool" and argType == bool) or \
-				(funName == "str" and argType == str):
-				return a.args[0]
-	return applyToChildren(a, cleanupTypes)
+		if (funName == "float" and argType == float) or \
+			(funName == "int" and argType == int) or \
+			(funName == "bool" and argType == bool) or \
+			(funName == "str" and argType == str):
+			return a.args[0]
+	return a
 
 def turnPositive(a):
 	"""Take a negative number and make it positive"""
@@ -2367,109 +2382,136 @@ def isNegative(a):
 	else:
 		return False
 
-def cleanupNegations(a):
-	"""Remove unneccessary negations"""
-	if not isinstance(a, ast.AST):
-		return a
-	elif type(a) == ast.BinOp:
-		a.left = cleanupNegations(a.left)
-		a.right = cleanupNegations(a.right)
+def negativeOf(a):
+	"""-a, cleaned up"""
+	return unaryNegationCleanup(ast.UnaryOp(ast.USub(addedOtherOp=True), a, addedOther=True))
 
-		if type(a.op) == ast.Add:
-			# x + (-y)
-			if isNegative(a.right):
-				a.right = turnPositive(a.right)
+def binOpNegationCleanup(a):
+	"""Remove unneccessary negations"""
+	if type(a.op) == ast.Add:
+		# x + (-y)
+		if isNegative(a.right):
+			a.right = turnPositive(a.right)
+			a.op = ast.Sub(global_id=a.op.global_id, num_negated=True)
+			return a
+		# (-x) + y
+		elif isNegative(a.left):
+			if couldCrash(a.left) and couldCrash(a.right):
+				return a # can't switch if it'll change the message
+			else:
+				(a.left,a.right) = (a.right,turnPositive(a.left))
 				a.op = ast.Sub(global_id=a.op.global_id, num_negated=True)
 				return a
-			# (-x) + y
-			elif isNegative(a.left):
-				if couldCrash(a.left) and couldCrash(a.right):
-					return a # can't switch if it'll change the message
-				else:
-					(a.left,a.right) = (a.right,turnPositive(a.left))
-					a.op = ast.Sub(global_id=a.op.global_id, num_negated=True)
-					return a
-		elif type(a.op) == ast.Sub:
-			# x - (-y)
-			if isNegative(a.right):
-				a.right = turnPositive(a.right)
+	elif type(a.op) == ast.Sub:
+		# x - (-y)
+		if isNegative(a.right):
+			a.right = turnPositive(a.right)
+			a.op = ast.Add(global_id=a.op.global_id, num_negated=True)
+			return a
+		elif type(a.right) == ast.BinOp:
+			# x - (y + z) = x + (-y - z)
+			if type(a.right.op) == ast.Add:
+				a.right.left = negativeOf(a.right.left)
+				a.right.op = ast.Sub(global_id=a.right.op.global_id, num_negated=True)
 				a.op = ast.Add(global_id=a.op.global_id, num_negated=True)
 				return a
-			elif type(a.right) == ast.BinOp:
-				# x - (y + z) = x + (-y - z)
-				if type(a.right.op) == ast.Add:
-					a.right.left = cleanupNegations(ast.UnaryOp(ast.USub(addedOtherOp=True), a.right.left, addedOther=True))
-					a.right.op = ast.Sub(global_id=a.right.op.global_id, num_negated=True)
+			# x - (y - z) = x + (-y + z) = x + (z - y)
+			elif type(a.right.op) == ast.Sub:
+				if couldCrash(a.right.left) and couldCrash(a.right.right):
+					a.right.left = negativeOf(a.right.left)
+					a.right.op = ast.Add(global_id=a.right.op.global_id, num_negated=True)
 					a.op = ast.Add(global_id=a.op.global_id, num_negated=True)
 					return a
-				# x - (y - z) = x + (-y + z) = x + (z - y)
-				elif type(a.right.op) == ast.Sub:
-					if couldCrash(a.right.left) and couldCrash(a.right.right):
-						a.right.left = cleanupNegations(ast.UnaryOp(ast.USub(addedOtherOp=True), a.right.left, addedOther=True))
-						a.right.op = ast.Add(global_id=a.right.op.global_id, num_negated=True)
-						a.op = ast.Add(global_id=a.op.global_id, num_negated=True)
-						return a
-					else:
-						(a.right.left, a.right.right) = (a.right.right, a.right.left)
-						a.op = ast.Add(global_id=a.op.global_id, num_negated=True)
-						return a
-		# Move negations to the outer part of multiplications
-		elif type(a.op) == ast.Mult:
-			# -x * -y
-			if isNegative(a.left) and isNegative(a.right):
-				a.left = turnPositive(a.left)
-				a.right = turnPositive(a.right)
-				return a
-			# -x * y = -(x*y)
-			elif isNegative(a.left):
-				if eventualType(a.right) in [int, float]:
-					a.left = turnPositive(a.left)
-					return cleanupNegations(ast.UnaryOp(ast.USub(addedOtherOp=True), a, addedOther=True))
-			# x * -y = -(x*y)
-			elif isNegative(a.right):
-				if eventualType(a.left) in [int, float]:
-					a.right = turnPositive(a.right)
-					return cleanupNegations(ast.UnaryOp(ast.USub(addedOtherOp=True), a, addedOther=True))
-		elif type(a.op) in [ast.Div, ast.FloorDiv]:
-			if isNegative(a.left) and isNegative(a.right):
+				else:
+					(a.right.left, a.right.right) = (a.right.right, a.right.left)
+					a.op = ast.Add(global_id=a.op.global_id, num_negated=True)
+					return a
+	# Move negations to the outer part of multiplications
+	elif type(a.op) == ast.Mult:
+		# -x * -y
+		if isNegative(a.left) and isNegative(a.right):
+			a.left = turnPositive(a.left)
+			a.right = turnPositive(a.right)
+			return a
+		# -x * y = -(x*y)
+		elif isNegative(a.left):
+			if eventualType(a.right) in [int, float]:
 				a.left = turnPositive(a.left)
+				return negativeOf(a)
+		# x * -y = -(x*y)
+		elif isNegative(a.right):
+			if eventualType(a.left) in [int, float]:
 				a.right = turnPositive(a.right)
-				return a
-		return a
-	elif type(a) == ast.UnaryOp:
-		a.operand = cleanupNegations(a.operand)
-		if type(a.op) == ast.USub:
-			if type(a.operand) == ast.BinOp:
-				# -(x + y) = -x - y
-				if type(a.operand.op) == ast.Add:
-					a.operand.left = cleanupNegations(ast.UnaryOp(ast.USub(addedOtherOp=True), a.operand.left, addedOther=True))
-					a.operand.op = ast.Sub(global_id=a.operand.op.global_id, num_negated=True)
+				return negativeOf(a)
+	elif type(a.op) in [ast.Div, ast.FloorDiv]:
+		if isNegative(a.left) and isNegative(a.right):
+			a.left = turnPositive(a.left)
+			a.right = turnPositive(a.right)
+			return a
+	return a
+
+def unaryNegationCleanup(a):
+	"""Push negations of sums and differences inwards"""
+	if type(a.op) == ast.USub:
+		if type(a.operand) == ast.BinOp:
+			# -(x + y) = -x - y
+			if type(a.operand.op) == ast.Add:
+				a.operand.left = negativeOf(a.operand.left)
+				a.operand.op = ast.Sub(global_id=a.operand.op.global_id, num_negated=True)
+				transferMetaData(a, a.operand)
+				return a.operand
+			# -(x - y) = -x + y = y - x
+			elif type(a.operand.op) == ast.Sub:
+				if couldCrash(a.operand.left) and couldCrash(a.operand.right):
+					a.operand.left = negativeOf(a.operand.left)
+					a.operand.op = ast.Add(global_id=a.operand.op.global_id, num_negated=True)
 					transferMetaData(a, a.operand)
 					return a.operand
-				# -(x - y) = -x + y = y - x
-				elif type(a.operand.op) == ast.Sub:
-					if couldCrash(a.operand.left) and couldCrash(a.operand.right):
-						a.operand.left = cleanupNegations(ast.UnaryOp(ast.USub(addedOtherOp=True), a.operand.left, addedOther=True))
-						a.operand.op = ast.Add(global_id=a.operand.op.global_id, num_negated=True)
-						transferMetaData(a, a.operand)
-						return a.operand
-					else:
-						(a.operand.left,a.operand.right) = (a.operand.right,a.operand.left)
-						transferMetaData(a, a.operand)
-						return a.operand
-		return a
-	# Special case for absolute value
-	elif type(a) == ast.Call and type(a.func) == ast.Name and a.func.id == "abs" and len(a.args) == 1:
-		a.args[0] = cleanupNegations(a.args[0])
+				else:
+					(a.operand.left,a.operand.right) = (a.operand.right,a.operand.left)
+					transferMetaData(a, a.operand)
+					return a.operand
+	return a
+
+def absNegationCleanup(a):
+	"""Special case for absolute value"""
+	if type(a.func) == ast.Name and a.func.id == "abs" and len(a.args) == 1:
 		if type(a.args[0]) == ast.UnaryOp and type(a.args[0].op) == ast.USub:
 			a.args[0] = a.args[0].operand
 		elif type(a.args[0]) == ast.BinOp and type(a.args[0].op) == ast.Sub:
 			if not (couldCrash(a.args[0].left) and couldCrash(a.args[0].right)) and \
 				compareASTs(a.args[0].left, a.args[0].right) > 0:
 				(a.args[0].left,a.args[0].right) = (a.args[0].right,a.args[0].left)
+	return a
+
+# The cleanups in the order they're tried on a node. When one replaces the node, the new node
+# only gets the cleanups that come after it, as it would have if each cleanup were its own pass.
+CLEANUPS = [	(ast.Compare, equalsCleanup),
+				(ast.BoolOp, boolOpCleanup),
+				(ast.Call, rangeCleanup),
+				(ast.Subscript, sliceCleanup),
+				(ast.BinOp, binOpTypeCleanup),
+				(ast.Call, callTypeCleanup),
+				(ast.BinOp, binOpNegationCleanup),
+				(ast.UnaryOp, unaryNegationCleanup),
+				(ast.Call, absNegationCleanup) ]
+
+CLEANUP_TABLE = { } # node type -> [(position in CLEANUPS, cleanup)]
+for (i, (nodeType, f)) in enumerate(CLEANUPS):
+	CLEANUP_TABLE.setdefault(nodeType, []).append((i, f))
+
+def cleanup(a):
+	"""Run all the cleanups over the tree in one bottom-up walk"""
+	if not isinstance(a, ast.AST):
 		return a
-	else:
-		return applyToChildren(a, cleanupNegations)
+	a = applyToChildren(a, cleanup)
+	done = -1 # the position of the last cleanup tried
+	while True:
+		later = [(i, f) for (i, f) in CLEANUP_TABLE.get(type(a), []) if i > done]
+		if len(later) == 0:
+			return a
+		(done, f) = later[0]
+		a = f(a)
 
 ### CONDITIONAL TRANSFORMATIONS ###
 
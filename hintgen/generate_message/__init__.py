@@ -1443,7 +1443,6 @@ def formatHints(s, edit, hintLevel, tree):
 
 	if len(edit) == 0:
 		hint.message = "No hints could be generated."
-		hint.save()
 		return hint
 
 	if hintLevel == "next_step" or hintLevel == "half_steps":
@@ -1536,5 +1535,4 @@ def formatHints(s, edit, hintLevel, tree):
 			e.start = tree
 			tree = e.applyChange()
 		hint.message = "Here is a correct solution to this problem which should be close to your solution: \n<b>" + printFunction(tree, 0) + "</b>"
-	hint.save()
 	return hint
\ No newline at end of file
@@ -1,5 +1,5 @@
 import ast, sys, io, pstats, cProfile, time, random, os
-from .canonicalize import getAllImports, getAllImportStatements, runGiveIds, anonymizeNames, getCanonicalForm, propogateMetadata, propogateNameMetadata
+from .canonicalize import runGiveIds, anonymizeNames, propogateMetadata, propogateNameMetadata
 from .path_construction import diffAsts, generateNextStates
 from .individualize import mapEdit
 from .generate_message import formatHints
@@ -7,11 +7,17 @@ from .getSyntaxHint import getSyntaxHint, applyChanges
 
 from .test import test
 from .display import printFunction
-from .astTools import deepcopy, tree_to_str, str_to_tree
+from .astTools import deepcopy, tree_to_str
 from .tools import log, parse_table
 from .paths import LOG_PATH
 
 from .models import *
+from .canonicalCache import cachedCanonicalForm
+from .problemMetadata import getMetadata
+from .solutionSpace import getSpace
+from .studentSession import previousHintLevel
+from .stageTimer import stage, timedRequest
+from .unitOfWork import UnitOfWork
 from .ChangeVector import *
 from .SyntaxEdit import *
 
@@ -156,7 +162,8 @@ def generate_cleaned_state(source_state):
 	else:
 		log("getHint\tgenerate_cleaned_state\tDuplicate code entries in cleaned: " + cleaned_code, "bug")
 	cleaned_state.tree = source_state.tree
-	cleaned_state = test(cleaned_state, forceRetest=True)
+	with stage("test"):
+		cleaned_state = test(cleaned_state, forceRetest=True)
 	if cleaned_state.score != source_state.score:
 		log("getHint\tgenerate_cleaned_state\tScore mismatch: " + \
 			str(source_state.score) + "," + str(cleaned_state.score) + "\n" + \
@@ -174,7 +181,7 @@ def generate_anon_state(cleaned_state, given_names, imports):
 		anon_state.count += 1
 	else:
 		anon_code = printFunction(anon_tree)
-		prior_anon = list(AnonState.objects.filter(problem=cleaned_state.problem, code=anon_code))
+		prior_anon = getSpace(cleaned_state.problem).withCode(AnonState, anon_code)
 		if len(prior_anon) == 0:
 			anon_state = AnonState(code=anon_code, problem=cleaned_state.problem, 
 								   score=cleaned_state.score, count=1,
@@ -187,7 +194,8 @@ def generate_anon_state(cleaned_state, given_names, imports):
 			anon_state.count += 1
 	anon_state.tree = anon_tree
 	anon_state.tree_source = tree_to_str(anon_tree)
-	anon_state = test(anon_state, forceRetest=False)
+	with stage("test"):
+		anon_state = test(anon_state, forceRetest=False)
 	if anon_state.score != cleaned_state.score:
 		log("getHint\tgenerate_anon_state\tScore mismatch: " + \
 			str(cleaned_state.score) + "," + str(anon_state.score) + "\n" + \
@@ -198,18 +206,16 @@ def generate_anon_state(cleaned_state, given_names, imports):
 
 def generate_canonical_state(cleaned_state, anon_state, given_names, imports):
 	# Second level of abstraction: canonicalize the AST. Gets rid of redundancies.
-	args = eval(anon_state.problem.arguments)
+	args = getMetadata(anon_state.problem).argTypes
 	orig_tree = deepcopy(cleaned_state.tree)
 	runGiveIds(orig_tree)
-	if type(args) != dict:
-		log("getHint\tgenerate_canonical_state\tBad args format: " + anon_state.problem.arguments, "bug")
-		args = { }
 	if anon_state.count > 1 and anon_state.canonical != None:
 		canonical_state = anon_state.canonical
 		canonical_state.orig_tree = orig_tree
 		canonical_state.orig_tree_source = tree_to_str(canonical_state.orig_tree)
 		canonical_state.tree = deepcopy(canonical_state.orig_tree)
-		canonical_state = getCanonicalForm(canonical_state, given_names, args, imports)
+		with stage("getCanonicalForm"):
+			canonical_state = cachedCanonicalForm(canonical_state, given_names, args, imports, anon_state.tree)
 		canonical_state.count += 1
 	else:
 		canonical_state = CanonicalState(code=cleaned_state.code, problem=cleaned_state.problem,
@@ -218,11 +224,13 @@ def generate_canonical_state(cleaned_state, anon_state, given_names, imports):
 		canonical_state.orig_tree = orig_tree
 		canonical_state.orig_tree_source = tree_to_str(canonical_state.orig_tree)
 		canonical_state.tree = deepcopy(canonical_state.orig_tree)
-		canonical_state = getCanonicalForm(canonical_state, given_names, args, imports)
-		canonical_state = test(canonical_state, forceRetest=False)
+		with stage("getCanonicalForm"):
+			canonical_state = cachedCanonicalForm(canonical_state, given_names, args, imports, anon_state.tree)
+		with stage("test"):
+			canonical_state = test(canonical_state, forceRetest=False)
 		if canonical_state.score != cleaned_state.score:
 			log("getHint\tgenerate_canonical_state\tScore mismatch: " + str(cleaned_state.score) + "," + str(canonical_state.score) + "\n" + cleaned_state.code + "\n" + canonical_state.code, "bug")
-		prior_canon = list(CanonicalState.objects.filter(problem=cleaned_state.problem, code=canonical_state.code))
+		prior_canon = getSpace(cleaned_state.problem).withCode(CanonicalState, canonical_state.code)
 		if len(prior_canon) == 0:
 			canonical_state.tree_source = tree_to_str(canonical_state.tree)
 			canonical_state.treeWeight = diffAsts.getWeight(canonical_state.tree)
@@ -240,12 +248,15 @@ def generate_canonical_state(cleaned_state, anon_state, given_names, imports):
 def generate_states(source_state, given_names, imports):
 	# Convert to cleaned, anonymous, and canonical states
 
-	cleaned_state = generate_cleaned_state(source_state)
-	cleaned_state.save()
-	anon_state = generate_anon_state(cleaned_state, given_names, imports)
-	anon_state.save()
-	canonical_state = generate_canonical_state(cleaned_state, anon_state, given_names, imports)
-	canonical_state.save()
+	with stage("generate_cleaned_state"):
+		cleaned_state = generate_cleaned_state(source_state)
+	with stage("generate_anon_state"):
+		anon_state = generate_anon_state(cleaned_state, given_names, imports)
+	with stage("generate_canonical_state"):
+		canonical_state = generate_canonical_state(cleaned_state, anon_state, given_names, imports)
+	# Saved now so that path construction can find them among the problem's states
+	with UnitOfWork() as work:
+		work.add(cleaned_state, anon_state, canonical_state)
 
 	source_state.cleaned = cleaned_state
 	cleaned_state.anon = anon_state
@@ -254,38 +265,28 @@ def generate_states(source_state, given_names, imports):
 	return (cleaned_state, anon_state, canonical_state)
 
 def save_states(source, cleaned, anon, canonical):
-	for s in [anon, canonical]:
-		g = s.goal
-		if g != None:
-			g.save()
-			s.goal = g
-		next_chain = [s]
-		while s.next != None:
-			s = s.next
-			next_chain.append(s)
-		for i in range(len(next_chain)-1, 0, -1):
-			n = next_chain[i]
-			g = n.goal
-			if g != None:
-				if g.goal != None:
+	# Everything goes in one transaction, so a crash can't leave a chain half-linked
+	with UnitOfWork() as work:
+		for s in [anon, canonical]:
+			work.add(s.goal)
+			next_chain = [s]
+			while s.next != None:
+				s = s.next
+				next_chain.append(s)
+			for i in range(len(next_chain)-1, 0, -1):
+				n = next_chain[i]
+				g = n.goal
+				if g != None and g.goal != None:
 					log("getHint\tsave_states\tWeird goal goal: " + str(g.score) + "," + g.code, "bug")
 					log("getHint\tsave_states\tWeird goal goal: " + str(g.goal.score) + "," + g.goal.code, "bug")
-				g.save()
-				n.goal = g
-			n.save()
-			next_chain[i-1].next = n
-
-	if source.hint != None:
-		source.hint.save()
-	canonical.save()
-	anon.save()
-	cleaned.save()
-	source.save()
+				work.add(g, n)
+		work.add(source.hint, canonical, anon, cleaned, source)
 
 def test_code(source_state):
 	# Parse the code, get tree and treeWeight
 	try:
-		source_state.tree = ast.parse(source_state.code)
+		with stage("parse"):
+			source_state.tree = ast.parse(source_state.code)
 		source_state.tree_source = tree_to_str(source_state.tree)
 		source_state.treeWeight = diffAsts.getWeight(source_state.tree)
 	except Exception as e:
@@ -293,30 +294,47 @@ def test_code(source_state):
 		source_state.tree = None
 
 	# Test the code, get score and feedback
-	source_state = test(source_state)
+	with stage("test"):
+		source_state = test(source_state)
 	return source_state
 
+@timedRequest
 def run_tests(source_state):
 	orig_code = source_state.code
 	source_state = test_code(source_state)
 	source_state.code = orig_code
 
-	args = eval(source_state.problem.arguments)
-	given_code = ast.parse(source_state.problem.given_code)
-	importNames = getAllImports(source_state.tree) + getAllImports(given_code)
-	inp = importNames + (list(args.keys()) if type(args) == dict else [])
-	given_names = [str(x) for x in inp]
-	imports = getAllImportStatements(source_state.tree) + getAllImportStatements(given_code)
+	meta = getMetadata(source_state.problem)
+	given_names = meta.givenNames(source_state.tree)
+	imports = meta.imports(source_state.tree)
 
 	if source_state.tree != None:
 		(cleaned_state, anon_state, canonical_state) = generate_states(source_state, given_names, imports)
-		save_states(source_state, cleaned_state, anon_state, canonical_state)
+		with stage("save_states"):
+			save_states(source_state, cleaned_state, anon_state, canonical_state)
 	else:
 		source_state.save()
 	return source_state
 
+def choose_hint_level(source_state, hint_level):
+	"""Resolves the default hint level, which escalates when the student resubmits the code they just got a hint for"""
+	if hint_level != "default":
+		return hint_level
+	prev_hint_level = previousHintLevel(source_state)
+	if prev_hint_level == "next_step":
+		return "structure"
+	elif prev_hint_level == "structure":
+		return "half_steps"
+	elif prev_hint_level in ["half_steps", "solution"]:
+		return "solution"
+	else:
+		return "next_step"
+
+@timedRequest
 def get_hint(source_state, hint_level="default"):
 	orig_code = source_state.code
+	level = choose_hint_level(source_state, hint_level)
+
 	source_state = test_code(source_state)
 	source_state.code = orig_code
 
@@ -324,23 +342,17 @@ def get_hint(source_state, hint_level="default"):
 	if source_state.tree == None:
 		return getSyntaxHint(source_state, "syntax_" + hint_level)
 
-	args = eval(source_state.problem.arguments)
-	given_code = ast.parse(source_state.problem.given_code)
-	importNames = getAllImports(source_state.tree) + getAllImports(given_code)
-	inp = importNames + (list(args.keys()) if type(args) == dict else [])
-	given_names = [str(x) for x in inp]
-	imports = getAllImportStatements(source_state.tree) + getAllImportStatements(given_code)
+	meta = getMetadata(source_state.problem)
+	given_names = meta.givenNames(source_state.tree)
+	imports = meta.imports(source_state.tree)
 
 	# Setup the correct states we need for future work
-	goals = list(AnonState.objects.filter(problem=source_state.problem, score=1)) + \
-			list(CanonicalState.objects.filter(problem=source_state.problem, score=1))
-	for goal in goals:
-		goal.tree = str_to_tree(goal.tree_source)
+	space = getSpace(source_state.problem)
+	goals = space.goals()
 
 	(cleaned_state, anon_state, canonical_state) = generate_states(source_state, given_names, imports)
 
-	states = list(AnonState.objects.filter(problem=source_state.problem)) + \
-			 list(CanonicalState.objects.filter(problem=source_state.problem))
+	states = space.states()
 
 	if source_state.score == 1:
 		examples = find_example_solutions(source_state, goals)
@@ -350,40 +362,20 @@ def get_hint(source_state, hint_level="default"):
 			hint.message += " If you're interested, here are some other correct solutions:\n"
 			for example in examples:
 				hint.message += "<b>" + example.code + "</b>\n\n"
-		hint.save()
 		source_state.hint = hint
 	else:
-		# Determine the hint level
-		if hint_level == "default":
-			submissions = list(SourceState.objects.filter(student=source_state.student))
-			if len(submissions) > 0 and submissions[-1].hint != None and submissions[-1].problem == source_state.problem and \
-				submissions[-1].code == source_state.code:
-				if submissions[-1].hint.level == "next_step":
-					hint_level = "structure"
-				elif submissions[-1].hint.level == "structure":
-					hint_level = "half_steps"
-				elif submissions[-1].hint.level in ["half_steps", "solution"]:
-					hint_level = "solution"
-				else:
-					hint_level = "next_step"
-			else:
-				hint_level = "next_step"
-
 		# If necessary, generate next/goal states for the anon and canonical states
-		if anon_state.goal == None:
-			generateNextStates.getNextState(anon_state, goals, states)
-		else:
-			# Is there a better goal available now?
-			best_goal = generateNextStates.chooseGoal(anon_state, goals, states)
-			if anon_state.goal != best_goal:
-				generateNextStates.getNextState(anon_state, goals, states, best_goal)
-		if canonical_state.goal == None:
-			generateNextStates.getNextState(canonical_state, goals, states)
-		else:
-			# Is there a better goal available now?
-			best_goal = generateNextStates.chooseGoal(canonical_state, goals, states)
-			if canonical_state.goal != best_goal:
-				generateNextStates.getNextState(canonical_state, goals, states, best_goal)
+		for state in [anon_state, canonical_state]:
+			if state.goal == None:
+				with stage("getNextState"):
+					generateNextStates.getNextState(state, goals, states)
+			else:
+				# Is there a better goal available now?
+				with stage("chooseGoal"):
+					best_goal = generateNextStates.chooseGoal(state, goals, states)
+				if state.goal != best_goal:
+					with stage("getNextState"):
+						generateNextStates.getNextState(state, goals, states, best_goal)
 
 		# Then choose the best path to use
 		anon_distance, _ = diffAsts.distance(anon_state, anon_state.goal, forceReweight=True)
@@ -401,16 +393,12 @@ def get_hint(source_state, hint_level="default"):
 				log("getHint\tget_hint\tCould not find next state for state " + str(used_state.id), "bug")
 				break
 			next_state = used_state.next
-			if not hasattr(next_state, "tree"):
-				next_state.tree = str_to_tree(next_state.tree_source)
 			edit = diffAsts.diffAsts(used_state.tree, next_state.tree)
 			edit, _ = generateNextStates.updateChangeVectors(edit, used_state.tree, used_state.tree)
 			if not hasattr(used_state, "orig_tree"):
-				if hasattr(used_state, "orig_tree_source") and used_state.orig_tree_source != "":
-					used_state.orig_tree = str_to_tree(used_state.orig_tree_source)
-				else:
-					log("getHint\tgetHint\tWhy no orig_tree?!?!" + str(used_state), "bug")
-			edit = mapEdit(used_state.tree, used_state.orig_tree, edit)
+				log("getHint\tgetHint\tWhy no orig_tree?!?!" + str(used_state), "bug")
+			with stage("mapEdit"):
+				edit = mapEdit(used_state.tree, used_state.orig_tree, edit)
 			if len(edit) == 0:
 				if next_state.next != None:
 					# Replace used_state's next with next_state's
@@ -426,13 +414,28 @@ def get_hint(source_state, hint_level="default"):
 						source_state.edit = None
 						source_state.hint = Hint(message="No hint could be generated")
 						break
-			hint = formatHints(used_state, edit, hint_level, used_state.orig_tree) # generate the right level of hint
+			with stage("formatHints"):
+				hint = formatHints(used_state, edit, level, used_state.orig_tree) # generate the right level of hint
 			source_state.edit = edit
 			source_state.hint = hint
 			source_state.goal = used_state.goal
 			break
 
 	# Save all the states!
-	save_states(source_state, cleaned_state, anon_state, canonical_state)
+	with stage("save_states"):
+		save_states(source_state, cleaned_state, anon_state, canonical_state)
 	return source_state
 
+def to_html(text):
+	return text.replace("\n", "<br>").replace("    ", "&nbsp;&nbsp;&nbsp;&nbsp;").replace("\t", "&nbsp;&nbsp;&nbsp;&nbsp;").replace("  ", "&nbsp;&nbsp;")
+
+def hint_response(source_state, kind="hint"):
+	"""Runs a hint request and returns the json object to send back. kind is "hint", or "feedback"
+		to answer with the test case results instead (for study conditions without hints)."""
+	if kind == "feedback":
+		source_state = run_tests(source_state)
+		return { "hint_message" : "Here's the test case results:<br>" + to_html(source_state.feedback),
+				 "line" : 1, "col" : 1, "hint_type" : "feedback" }
+	source_state = get_hint(source_state)
+	return { "hint_message" : to_html(source_state.hint.message), "line" : source_state.hint.line,
+			 "col" : source_state.hint.col, "hint_type" : source_state.hint.level }
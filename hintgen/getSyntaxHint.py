@@ -6,6 +6,7 @@ from .display import printFunction
 #from .lexerSyntaxHint import getLexerSyntaxHint
 from .SyntaxEdit import SyntaxEdit
 from .models import SourceState, Hint
+from .studentSession import previousHintLevel
 
 def smartSplit(code):
 	tokens = []
@@ -375,10 +376,8 @@ def getSyntaxHint(source_state, hint_level):
 
 	# Determine the hint level
 	if hint_level == "syntax_default":
-		submissions = list(SourceState.objects.filter(student=source_state.student))
-		if len(submissions) > 0 and submissions[-1].hint != None and submissions[-1].problem == source_state.problem and \
-			submissions[-1].code == source_state.code:
-			prev_hint_level = submissions[-1].hint.level
+		prev_hint_level = previousHintLevel(source_state)
+		if prev_hint_level != None:
 			if "syntax" in prev_hint_level:
 				if prev_hint_level == "syntax_next_step":
 					hint_level = "syntax_structure"
@@ -0,0 +1,100 @@
+"""A hint job queue kept in the database, so that the web server doesn't have to generate
+hints inside the request. The hint view enqueues a job and returns its ID, any number of
+worker processes (see the hint_worker management command) claim and run jobs, and the
+client polls the hint_status view until the job is done. A running job's worker keeps its
+heartbeat fresh, so only jobs whose worker died go back in the queue, and a worker can only
+finish a job it still holds the claim for."""
+import datetime, json, threading, time, uuid
+from django.db import connection, DatabaseError
+from django.utils import timezone
+from .models import HintJob, SourceState
+from .getHint import hint_response
+from .tools import log
+
+POLL_TIME = 0.2 # seconds between checks for new jobs (workers) or finished jobs (long polls)
+HEARTBEAT_TIME = 30 # seconds between a running job's heartbeats
+STALE_TIME = 300 # a running job whose heartbeat is this old lost its worker, so it goes back in the queue
+
+def enqueue(student, problem, code, kind="hint"):
+	job = HintJob(student=student, problem=problem, code=code, kind=kind)
+	job.save()
+	return job
+
+def claim():
+	"""Takes the oldest queued job, or returns None. The status only changes if it's still queued,
+		so two workers can never claim the same job."""
+	stale = timezone.now() - datetime.timedelta(seconds=STALE_TIME)
+	HintJob.objects.filter(status="running", updated__lt=stale).update(status="queued", worker="")
+	worker = uuid.uuid4().hex
+	for job_id in HintJob.objects.filter(status="queued").values_list("id", flat=True)[:10]:
+		if HintJob.objects.filter(id=job_id, status="queued").update(status="running", worker=worker, updated=timezone.now()) == 1:
+			return HintJob.objects.get(id=job_id)
+	return None
+
+def beat(job):
+	"""Marks the job as still running. Returns False if this worker has lost its claim."""
+	return HintJob.objects.filter(id=job.id, status="running", worker=job.worker).update(updated=timezone.now()) == 1
+
+class Heartbeat(threading.Thread):
+	"""Beats for a job every HEARTBEAT_TIME seconds until it's stopped"""
+	def __init__(self, job):
+		threading.Thread.__init__(self, daemon=True)
+		self.job = job
+		self.stopped = threading.Event()
+
+	def run(self):
+		try:
+			while not self.stopped.wait(HEARTBEAT_TIME):
+				try:
+					if not beat(self.job):
+						return
+				except DatabaseError as e: # the database may be busy; the next beat can still make it
+					log("hintQueue\tHeartbeat\tJob " + str(self.job.id) + " missed a beat: " + str(e), "bug")
+		finally:
+			connection.close() # this thread's own connection
+
+	def stop(self):
+		self.stopped.set()
+		self.join()
+
+def finish(job, status, result):
+	"""Records the job's result, unless another worker has claimed it since. Returns whether it did."""
+	finished = HintJob.objects.filter(id=job.id, status="running", worker=job.worker).update(
+		status=status, result=result, updated=timezone.now()) == 1
+	if not finished:
+		log("hintQueue\tfinish\tJob " + str(job.id) + " was claimed by another worker", "bug")
+	return finished
+
+def run(job):
+	heartbeat = Heartbeat(job)
+	heartbeat.start()
+	try:
+		code_state = SourceState(code=job.code, problem=job.problem, student=job.student, count=1)
+		result_object = hint_response(code_state, job.kind)
+		status, result = "done", json.dumps(result_object)
+	except Exception as e:
+		log("hintQueue\trun\tJob " + str(job.id) + " broke: " + str(e), "bug")
+		status, result = "failed", json.dumps({ "error" : "Could not generate a hint for this code" })
+	finally:
+		heartbeat.stop()
+	finish(job, status, result)
+
+def work(once=False):
+	"""Runs jobs as they come in. With once=True, stops when the queue is empty."""
+	while True:
+		job = claim()
+		if job != None:
+			run(job)
+		elif once:
+			return
+		else:
+			time.sleep(POLL_TIME)
+
+def wait_for(job_id, timeout):
+	"""Returns the job once it's finished, or as it is after timeout seconds"""
+	start = time.time()
+	while True:
+		job = HintJob.objects.get(id=job_id)
+		if job.status in ["done", "failed"] or time.time() - start >= timeout:
+			return job
+		time.sleep(POLL_TIME)
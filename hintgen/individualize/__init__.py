@@ -1,4 +1,4 @@
-import ast, copy
+import ast, copy, itertools, weakref
 from ..path_construction import diffAsts, generateNextStates
 from ..ChangeVector import *
 from ..astTools import negate, num_negate, isAnonVariable, removePropertyFromAll, transferMetaData, isStatement, compareASTs
@@ -8,7 +8,8 @@ from ..tools import log
 from ..namesets import astNames
 from ..display import printFunction
 
-def generatePathToId(a, id, globalId=None):
+def searchPathToId(a, id, globalId=None):
+	"""The path to the first node with the id, found by walking the tree"""
 	if not isinstance(a, ast.AST):
 		return None
 	if hasattr(a, "global_id") and a.global_id == id:
@@ -19,18 +20,85 @@ def generatePathToId(a, id, globalId=None):
 		attr = getattr(a, field)
 		if type(attr) == list:
 			for i in range(len(attr)):
-				path = generatePathToId(attr[i], id, globalId)
+				path = searchPathToId(attr[i], id, globalId)
 				if path != None:
 					path.append(i)
 					path.append((field, astNames[type(a)]))
 					return path
 		else:
-			path = generatePathToId(attr, id, globalId)
+			path = searchPathToId(attr, id, globalId)
 			if path != None:
 				path.append((field, astNames[type(a)]))
 				return path
 	return None
 
+idTables = weakref.WeakKeyDictionary() # tree -> (edit stamp, { global id : paths to the nodes with that id, in search order })
+editStamps = itertools.count()
+editStamp = next(editStamps) # changes whenever a tree may have been edited in place
+
+def treesEdited():
+	"""Call after editing a tree in place, so every id table is rebuilt before it's used again"""
+	global editStamp
+	editStamp = next(editStamps)
+
+def buildIdTable(a):
+	table = { }
+	def visit(node, path):
+		if not isinstance(node, ast.AST):
+			return
+		if hasattr(node, "global_id"):
+			table.setdefault(node.global_id, []).append(path)
+		name = astNames.get(type(node))
+		for field in node._fields:
+			attr = getattr(node, field)
+			if type(attr) == list:
+				for i in range(len(attr)):
+					visit(attr[i], [i, (field, name)] + path)
+			else:
+				visit(attr, [(field, name)] + path)
+	visit(a, [])
+	return table
+
+def nodeAtPath(a, path):
+	"""Follows a path from generatePathToId, or returns None if the tree doesn't have it"""
+	for step in reversed(path):
+		if type(step) == int:
+			if type(a) != list or step >= len(a):
+				return None
+			a = a[step]
+		else:
+			(field, name) = step
+			if not isinstance(a, ast.AST) or name == None or astNames.get(type(a)) != name or field not in a._fields:
+				return None
+			a = getattr(a, field)
+	return a
+
+def tablePathToId(a, id, globalId=None):
+	"""Looks the id up in the tree's id table. The table is rebuilt if any tree has been edited
+		in place since it was built (see treesEdited), and again if a hit doesn't match the tree.
+		Returns None if the table has no such node, since then the tree may have gained it."""
+	if not isinstance(a, ast.AST):
+		return None
+	for rebuild in [False, True]:
+		entry = idTables.get(a)
+		if rebuild or entry == None or entry[0] != editStamp:
+			entry = idTables[a] = (editStamp, buildIdTable(a))
+		for path in entry[1].get(id, []):
+			node = nodeAtPath(a, path)
+			if node == None or getattr(node, "global_id", None) != id:
+				break # out of date
+			if globalId == None or getattr(node, "variableGlobalId", None) == globalId:
+				return path
+		else:
+			return None
+	return None
+
+def generatePathToId(a, id, globalId=None):
+	path = tablePathToId(a, id, globalId)
+	if path != None:
+		return list(path) # callers change their paths
+	return searchPathToId(a, id, globalId)
+
 def childHasTag(a, tag):
 	""" Includes the AST itself"""
 	if hasattr(a, tag):
@@ -193,18 +261,24 @@ def createNameMap(a, d=None):
 	return d
 
 def findId(a, id):
+	path = tablePathToId(a, id)
+	if path != None:
+		return nodeAtPath(a, path)
+	return searchId(a, id)
+
+def searchId(a, id):
 	if hasattr(a, "global_id") and a.global_id == id:
 		return a
 	if type(a) == list:
 		for child in a:
-			tmp = findId(child, id)
+			tmp = searchId(child, id)
 			if tmp != None:
 				return tmp
 		return None
 	if not isinstance(a, ast.AST):
 		return None
 	for child in ast.iter_child_nodes(a):
-		tmp = findId(child, id)
+		tmp = searchId(child, id)
 		if tmp != None:
 			return tmp
 	return None
@@ -793,6 +867,7 @@ def mapEdit(canon, orig, edit, nameMap=None):
 	originalEdit = edit
 	edit = copy.deepcopy(edit)
 	updatedOrig = deepcopy(orig)
+	treesEdited() # the trees may have changed since they were last looked at
 	replacedVariables = []
 	alreadyEdited = []
 	while count < len(edit):
@@ -847,6 +922,7 @@ def mapEdit(canon, orig, edit, nameMap=None):
 							parent[pos] = deepcopy(cv.oldSubtree)
 						else:
 							setattr(parent, pos, deepcopy(cv.oldSubtree))
+						treesEdited()
 					else:
 						log("individualize\tmapEdit\tMissing SubVector globalId: " + str(cv) + "\n" + \
 							printFunction(updatedOrig) + "\n" + printFunction(orig), "bug")
@@ -858,6 +934,7 @@ def mapEdit(canon, orig, edit, nameMap=None):
 						parent[pos] = cv.newSubtree
 					else:
 						setattr(parent, pos, cv.newSubtree)
+					treesEdited()
 					cv.newSubtree = prev_new_subtree
 		else:
 			cv = specialFunctions(cv, cv.oldSubtree, cv.newSubtree)
@@ -0,0 +1,28 @@
+"""Replays recorded submissions through hint chains. manage.py doesn't run Django's commands,
+so start this with python run_command.py hint_benchmark [problems] [--processes N] [--limit N]"""
+from django.core.management.base import BaseCommand
+from hintgen.analysis import stats_problem_set
+from hintgen.benchmark import DATA_PATH, runBenchmark, writeReport
+from hintgen.paths import LOG_PATH
+
+class Command(BaseCommand):
+	help = "Replays recorded submissions through hint chains, each problem in its own test database, and writes a JSON report"
+
+	def add_arguments(self, parser):
+		parser.add_argument("problems", nargs="*", help="problem names (default: the stats problem set)")
+		parser.add_argument("--data", default=DATA_PATH, help="directory holding a <problem>.csv file per problem")
+		parser.add_argument("--processes", type=int, default=1, help="number of problems to run at once")
+		parser.add_argument("--limit", type=int, default=None, help="only replay this many submissions per problem")
+		parser.add_argument("--output", default=LOG_PATH + "benchmark.json", help="where to write the report")
+
+	def handle(self, *args, **options):
+		problems = options["problems"] if len(options["problems"]) > 0 else stats_problem_set
+		report = runBenchmark(problems, options["data"], options["processes"], options["limit"])
+		writeReport(report, options["output"])
+		for problem in report["problems"]:
+			if "error" in problem:
+				self.stdout.write(problem["problem"] + ": error")
+			else:
+				self.stdout.write(problem["problem"] + ": " + str(problem["outcomes"]) + ", p95 " + \
+								  str(round(problem["latency"]["p95"] or 0, 3)) + "s")
+		self.stdout.write("Report written to " + options["output"])
@@ -0,0 +1,28 @@
+"""Runs queued hint jobs. manage.py doesn't run Django's commands, so start this with
+python run_command.py hint_worker [--processes N] [--once]"""
+import multiprocessing
+from django.core.management.base import BaseCommand
+from django.db import connection
+from hintgen.hintQueue import work
+
+def workerMain(once):
+	connection.close() # each process needs its own database connection
+	work(once)
+
+class Command(BaseCommand):
+	help = "Runs queued hint jobs (see the async option of the hint view)"
+
+	def add_arguments(self, parser):
+		parser.add_argument("--processes", type=int, default=1, help="number of jobs to run at once")
+		parser.add_argument("--once", action="store_true", help="stop when the queue is empty")
+
+	def handle(self, *args, **options):
+		if options["processes"] <= 1:
+			work(options["once"])
+			return
+		connection.close()
+		procs = [multiprocessing.Process(target=workerMain, args=(options["once"],)) for i in range(options["processes"])]
+		for p in procs:
+			p.start()
+		for p in procs:
+			p.join()
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 17:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hintgen', '0029_auto_20170127_1722'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code_hash', models.CharField(max_length=64)),
+                ('suite_hash', models.CharField(max_length=64)),
+                ('score', models.FloatField()),
+                ('feedback', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='testresult',
+            unique_together=set([('code_hash', 'suite_hash')]),
+        ),
+    ]
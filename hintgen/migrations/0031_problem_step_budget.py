@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 17:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hintgen', '0030_testresult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='step_budget',
+            field=models.IntegerField(default=500000),
+        ),
+    ]
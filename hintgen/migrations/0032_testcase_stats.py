@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 17:28
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hintgen', '0031_problem_step_budget'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testcase',
+            name='times_failed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='testcase',
+            name='times_run',
+            field=models.IntegerField(default=0),
+        ),
+    ]
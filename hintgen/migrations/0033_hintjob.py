@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 17:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hintgen', '0032_testcase_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HintJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.TextField()),
+                ('kind', models.CharField(default='hint', max_length=20)),
+                ('status', models.CharField(default='queued', max_length=20)),
+                ('result', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hint_jobs', to='hintgen.Problem')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hint_jobs', to='hintgen.Student')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
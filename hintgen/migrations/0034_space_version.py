@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 17:33
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hintgen', '0033_hintjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='space_version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='state',
+            name='space_version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
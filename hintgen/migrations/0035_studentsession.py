@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 17:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import hashlib
+
+
+def fill_sessions(apps, schema_editor):
+    # Start each session from the student's latest submission to the problem
+    SourceState = apps.get_model('hintgen', 'SourceState')
+    StudentSession = apps.get_model('hintgen', 'StudentSession')
+    sessions = {}
+    for (student_id, problem_id, code, level) in SourceState.objects.exclude(student=None).order_by('id') \
+            .values_list('student_id', 'problem_id', 'code', 'hint__level'):
+        attempts = sessions[(student_id, problem_id)].attempts + 1 if (student_id, problem_id) in sessions else 1
+        sessions[(student_id, problem_id)] = StudentSession(student_id=student_id, problem_id=problem_id, attempts=attempts,
+            last_code_hash=hashlib.sha256(code.encode("utf-8")).hexdigest(), last_hint_level=level)
+    StudentSession.objects.bulk_create(list(sessions.values()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hintgen', '0034_space_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentSession',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_code_hash', models.CharField(max_length=64)),
+                ('last_hint_level', models.CharField(blank=True, max_length=50, null=True)),
+                ('last_timestamp', models.DateTimeField(auto_now=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sessions', to='hintgen.Problem')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sessions', to='hintgen.Student')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='studentsession',
+            unique_together=set([('student', 'problem')]),
+        ),
+        migrations.RunPython(fill_sessions, migrations.RunPython.noop),
+    ]
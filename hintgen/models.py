@@ -1,4 +1,5 @@
 from django.db import models
+from .astTools import str_to_tree
 
 class Course(models.Model):
     name = models.CharField(max_length=100)
@@ -25,6 +26,8 @@ class Problem(models.Model):
     solution = models.ForeignKey('SourceState', on_delete=models.SET_NULL, related_name="+", blank=True, null=True)
     arguments = models.CharField(max_length=500) # should be interpreted by pickle
     given_code = models.TextField(blank=True) # should be interpreted by pickle
+    step_budget = models.IntegerField(default=500000) # how many lines/calls student code may run while loading, and again for each test
+    space_version = models.IntegerField(default=0) # bumped whenever one of the problem's anon/canonical states changes
     def __str__(self):
         return self.name
 
@@ -36,12 +39,25 @@ class Testcase(models.Model):
     test_input = models.TextField() 
     test_output = models.TextField()
     test_extra = models.TextField(blank=True) # specific keywords specify extra tests. For example, 'checkCopy' checks if the input is modified
+    times_run = models.IntegerField(default=0) # how many submissions have run this test
+    times_failed = models.IntegerField(default=0) # and how many of them failed it; tests that fail often run first
     def __str__(self):
         return "Test " + str(self.id) + " for " + str(self.problem)
 
     class Meta:
         ordering = ['problem', 'id']
 
+class TestResult(models.Model):
+    code_hash = models.CharField(max_length=64) # sha256 of the normalized code
+    suite_hash = models.CharField(max_length=64) # sha256 of the problem's tests and given code
+    score = models.FloatField()
+    feedback = models.TextField(blank=True)
+    def __str__(self):
+        return "Result " + str(self.id) + ": " + str(self.score)
+
+    class Meta:
+        unique_together = ('code_hash', 'suite_hash')
+
 class State(models.Model):
     code = models.TextField()
     problem = models.ForeignKey('Problem', on_delete=models.CASCADE, related_name="states")
@@ -52,9 +68,53 @@ class State(models.Model):
     treeWeight = models.IntegerField(blank=True, null=True)
     next = models.ForeignKey('State', on_delete=models.SET_NULL, related_name="prev", blank=True, null=True)
     goal = models.ForeignKey('State', on_delete=models.SET_NULL, related_name="feeder", blank=True, null=True)
+    space_version = models.IntegerField(default=0) # the problem's space_version when this state last changed
     def __str__(self):
         return str(self.problem) + " State " + str(self.id)
 
+    # The trees are only decoded when something uses them. A state with no source and
+    # no assigned tree has no tree attribute at all, as before.
+    @property
+    def tree(self):
+        if "_tree" not in self.__dict__:
+            if self.tree_source == "":
+                raise AttributeError("tree")
+            self._tree = str_to_tree(self.tree_source)
+        return self._tree
+
+    @tree.setter
+    def tree(self, value):
+        self._tree = value
+
+    @property
+    def orig_tree(self):
+        if "_orig_tree" not in self.__dict__:
+            if getattr(self, "orig_tree_source", "") == "":
+                raise AttributeError("orig_tree")
+            self._orig_tree = str_to_tree(self.orig_tree_source)
+        return self._orig_tree
+
+    @orig_tree.setter
+    def orig_tree(self, value):
+        self._orig_tree = value
+
+    # Unchanged states are skipped when a unit of work saves (see unitOfWork.py)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(State, cls).from_db(db, field_names, values)
+        if len(instance.get_deferred_fields()) == 0:
+            instance.remember_values()
+        return instance
+
+    def field_values(self):
+        return [getattr(self, f.attname) for f in self._meta.concrete_fields]
+
+    def remember_values(self):
+        self._saved_values = self.field_values()
+
+    def changed(self):
+        return self.pk == None or getattr(self, "_saved_values", None) != self.field_values()
+
     class Meta:
         ordering = ['problem', 'id']
 
@@ -85,3 +145,32 @@ class Hint(models.Model):
 
     class Meta:
         ordering = ['level', '-id']
+
+class HintJob(models.Model):
+    student = models.ForeignKey('Student', on_delete=models.CASCADE, related_name="hint_jobs")
+    problem = models.ForeignKey('Problem', on_delete=models.CASCADE, related_name="hint_jobs")
+    code = models.TextField()
+    kind = models.CharField(max_length=20, default="hint") # hint, or feedback for students who only get test results
+    status = models.CharField(max_length=20, default="queued") # queued, running, done, or failed
+    result = models.TextField(blank=True) # the json object the hint view would have returned
+    worker = models.CharField(max_length=32, blank=True) # the claim of the worker running it; only that worker may finish it
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True) # kept fresh by the running worker's heartbeat
+    def __str__(self):
+        return "Hint job " + str(self.id) + " (" + self.status + ")"
+
+    class Meta:
+        ordering = ['id']
+
+class StudentSession(models.Model):
+    student = models.ForeignKey('Student', on_delete=models.CASCADE, related_name="sessions")
+    problem = models.ForeignKey('Problem', on_delete=models.CASCADE, related_name="sessions")
+    last_code_hash = models.CharField(max_length=64) # sha256 of the last submission's code
+    last_hint_level = models.CharField(max_length=50, blank=True, null=True) # None if it didn't get a hint
+    last_timestamp = models.DateTimeField(auto_now=True)
+    attempts = models.IntegerField(default=0)
+    def __str__(self):
+        return str(self.student) + " on " + str(self.problem)
+
+    class Meta:
+        unique_together = ('student', 'problem')
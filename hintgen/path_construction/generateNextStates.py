@@ -2,11 +2,12 @@ import copy
 from ..tools import *
 from ..astTools import *
 from ..display import *
-from ..test import test as codetest
+from ..test import test as codetest, test_batch as codetestBatch, canReach
 from .diffAsts import *
 from ..State import *
 from ..ChangeVector import *
 from ..models import AnonState, CanonicalState
+from ..problemMetadata import getMetadata
 
 def getNextId(states, idStart):
 	count = 0
@@ -112,8 +113,10 @@ def updateChangeVectors(changes, oldStart, newStart):
 		newState = change.applyChange()
 	return changes, newState
 
-def applyChangeVectors(s, changes, states, goals):
-	"""Attempt to apply all the changes listed to the solution state s"""
+def applyChangeVectors(s, changes, states, goals, runTests=True, atLeast=None):
+	"""Attempt to apply all the changes listed to the solution state s. With runTests=False,
+		new states are left untested (and out of goals) so that the caller can test them in a batch.
+		With atLeast, a new state's tests stop once it can't score that much (see test_batch)."""
 	if len(changes) == 0:
 		return s
 	tup = updateChangeVectors(changes, changes[0].start, s.tree)
@@ -135,10 +138,11 @@ def applyChangeVectors(s, changes, states, goals):
 		n.tree = newState
 		n.tree_source = tree_to_str(newState)
 		n.treeWeight = getWeight(newState)
-		n = codetest(n)
 		states.append(n)
-		if n.score == 1:
-			goals.append(n)
+		if runTests:
+			n = codetest(n, atLeast=atLeast)
+			if n.score == 1:
+				goals.append(n)
 		return n
 
 def chooseGoal(s, goals, states):
@@ -176,7 +180,7 @@ def chooseGoal(s, goals, states):
 	return goal
 
 def generateHelperDistributions(s, g, goals, states):
-	restricted_names = list(eval(s.problem.arguments).keys())
+	restricted_names = list(getMetadata(s.problem).argNames)
 	sHelpers = gatherAllHelpers(s.tree, restricted_names)
 	gHelpers = gatherAllHelpers(g.tree, restricted_names)
 	nonMappableHelpers = gatherAllFunctionNames(g.tree)
@@ -257,7 +261,7 @@ def generateHelperDistributions(s, g, goals, states):
 def generateVariableDistributions(s, g, goals, states):
 	sParameters = gatherAllParameters(s.tree)
 	gParameters = gatherAllParameters(g.tree, keep_orig=False)
-	restricted_names = list(eval(s.problem.arguments).keys()) + getAllImports(s.tree) + getAllImports(g.tree)
+	restricted_names = getMetadata(s.problem).argNames + getAllImports(s.tree) + getAllImports(g.tree)
 	sHelpers = gatherAllHelpers(s.tree, restricted_names)
 	gHelpers = gatherAllHelpers(g.tree, restricted_names)
 	sVariables = gatherAllVariables(s.tree)
@@ -411,7 +415,8 @@ def optimizeGoal(s, changes, states, goals):
 				if isStrictSubset(currentEdits, newChanges):	continue
 
 				# Check to see that the state exists and that it isn't too far away
-				newState = applyChangeVectors(s, newChanges, states, goals)
+				# Anything that scores worse than s can't be a goal or a next state, so don't finish testing it
+				newState = applyChangeVectors(s, newChanges, states, goals, atLeast=s.score)
 				if newState == None: # shouldn't happen
 					log("generateNextStates\toptimizeGoal\tBroken edit: " + str(newChanges), "bug")
 					continue
@@ -439,7 +444,7 @@ def fastOptimizeGoal(s, changes, states, goals, includeSmallSets=False):
 	currentGoal, currentDiff, currentEdits = s.goal, s.goalDist, changes
 	for changeSet in fastChanges:
 		if isStrictSubset(currentEdits, changeSet):	continue
-		newState = applyChangeVectors(s, changeSet, states, goals)
+		newState = applyChangeVectors(s, changeSet, states, goals, atLeast=s.score)
 		if newState == None:	continue
 		newDistance, _ = distance(s, newState, givenChanges=changeSet)
 		if newDistance <= currentDiff and newState.score == 1:
@@ -469,6 +474,8 @@ def isValidNextState(s, n, g):
 		return False # didn't load properly
 
 	# Third: is test.test(n) >= test.test(s)?
+	if not canReach(n, s.score): # its tests were already cut short
+		return False
 	n = codetest(n)
 	if n.score < s.score and abs(n.score - s.score) > 0.001:
 		return False
@@ -513,8 +520,18 @@ def getAllCombinations(s, changes, states, goals):
 	allChanges = powerSet(changes)
 	# Also find the solution states associated with the changes
 	allCombinations = []
+	newStates = []
 	for x in allChanges:
-		allCombinations.append((x, applyChangeVectors(s, x, states, goals)))
+		n = applyChangeVectors(s, x, states, goals, runTests=False)
+		allCombinations.append((x, n))
+		if n != None and n.score == None and n not in newStates:
+			newStates.append(n)
+	# Then test all the new states in one go, instead of paying for a test run per combination.
+	# States that can't score as well as s will fail isValidNextState, so their tests can stop early.
+	codetestBatch(newStates, atLeast=s.score)
+	for n in newStates:
+		if n.score == 1:
+			goals.append(n)
 	return allCombinations
 
 def getNextState(s, goals, states, given_goal=None):
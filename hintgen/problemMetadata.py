@@ -0,0 +1,49 @@
+"""What every request needs to know about a problem besides the student's code: its argument
+types and the names and imports its given code provides. These are worked out once per
+process, and worked out again whenever the problem's arguments or given code no longer match
+(other processes can edit the problem, and their signals never reach this one). (The test
+fixtures' version lives in the problem's FixtureBundle, see test/fixtures.py.)"""
+import ast
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .astTools import getAllImports, getAllImportStatements
+from .models import Problem
+from .tools import log
+
+metadata = { } # problem id -> ProblemMetadata
+
+class ProblemMetadata:
+	def __init__(self, problem):
+		self.stamp = stamp(problem)
+		args = eval(problem.arguments)
+		if type(args) != dict:
+			log("problemMetadata\tProblemMetadata\tBad args format: " + problem.arguments, "bug")
+			args = { }
+		self.argTypes = args # function name -> list of argument types
+		self.argNames = list(args.keys())
+		self.givenTree = ast.parse(problem.given_code)
+		self.givenImportNames = getAllImports(self.givenTree)
+		self.givenImports = getAllImportStatements(self.givenTree)
+
+	def givenNames(self, tree):
+		"""The names that anonymization should leave alone in the given tree"""
+		return [str(x) for x in getAllImports(tree) + self.givenImportNames + self.argNames]
+
+	def imports(self, tree):
+		return getAllImportStatements(tree) + self.givenImports
+
+def stamp(problem):
+	"""Everything the metadata is worked out from"""
+	return (problem.arguments, problem.given_code)
+
+def getMetadata(problem):
+	meta = metadata.get(problem.id)
+	if meta == None or meta.stamp != stamp(problem):
+		meta = ProblemMetadata(problem)
+		metadata[problem.id] = meta
+	return meta
+
+@receiver(post_save, sender=Problem)
+@receiver(post_delete, sender=Problem)
+def problemChanged(sender, instance, **kwargs):
+	metadata.pop(instance.id, None)
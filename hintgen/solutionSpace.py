@@ -0,0 +1,172 @@
+"""An in-memory copy of each problem's solution space (its anon and canonical states), so that
+a hint request doesn't have to load and unpickle every state the problem has ever seen.
+Every change to one of these states stamps it with the problem's next space_version, so a
+process only has to read the states that changed since it last looked, and nothing at all if
+the problem's space_version hasn't moved. Each request still
+gets its own fresh State objects, since path construction modifies the states it's given."""
+import threading
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Problem, AnonState, CanonicalState
+from .unitOfWork import currentWork
+
+CLASSES = [AnonState, CanonicalState]
+OVERLAP = 50 # re-read states this many versions back, in case another process's save committed late
+
+spaces = { } # problem id -> SolutionSpace
+spacesLock = threading.Lock()
+
+def fieldNames(cls):
+	"""The names to query each field by, and the names to build an object from, in field order"""
+	fields = cls._meta.concrete_fields
+	return [f.name for f in fields], [f.attname for f in fields]
+
+def rowOf(instance):
+	names, attnames = fieldNames(type(instance))
+	return tuple(getattr(instance, attname) for attname in attnames)
+
+class SolutionSpace:
+	def __init__(self, problem_id):
+		self.problem_id = problem_id
+		self.rows = { } # class -> state id -> the state's field values
+		self.codes = { } # class -> code -> ids of the states with that code
+		self.version = None # the highest space_version seen, or None if nothing is loaded yet
+		self.problemVersion = None # the problem's space_version at the last sync
+		self.lock = threading.Lock()
+
+	def load(self):
+		self.rows = { cls : { } for cls in CLASSES }
+		self.codes = { cls : { } for cls in CLASSES }
+		self.version = 0
+		for cls in CLASSES:
+			names, attnames = fieldNames(cls)
+			for row in cls.objects.filter(problem_id=self.problem_id).values_list(*names):
+				self.put(cls, row)
+
+	def sync(self):
+		"""Catches up with the changes other processes have made. Saving or deleting a state
+			always moves the problem's space_version, so that's the only thing read if it hasn't."""
+		problemVersion = Problem.objects.filter(id=self.problem_id).values_list("space_version", flat=True).first()
+		if self.version != None and problemVersion == self.problemVersion:
+			return
+		self.problemVersion = problemVersion
+		if self.version == None:
+			self.load()
+			return
+		for cls in CLASSES:
+			names, attnames = fieldNames(cls)
+			changed = cls.objects.filter(problem_id=self.problem_id, space_version__gt=self.version - OVERLAP)
+			for row in changed.values_list(*names):
+				self.put(cls, row)
+		# Deleted states don't leave anything behind to find, so check that nothing's missing
+		for cls in CLASSES:
+			if cls.objects.filter(problem_id=self.problem_id).count() != len(self.rows[cls]):
+				self.load()
+				return
+
+	def put(self, cls, row):
+		names, attnames = fieldNames(cls)
+		pk = row[attnames.index(cls._meta.pk.attname)]
+		self.remove(cls, pk)
+		self.rows[cls][pk] = row
+		code = row[attnames.index("code")]
+		self.codes[cls][code] = self.codes[cls].get(code, []) + [pk]
+		self.version = max(self.version, row[attnames.index("space_version")])
+
+	def remove(self, cls, pk):
+		if pk in self.rows[cls]:
+			names, attnames = fieldNames(cls)
+			code = self.rows[cls][pk][attnames.index("code")]
+			self.codes[cls][code].remove(pk)
+			del self.rows[cls][pk]
+
+	def unchanged(self, instance):
+		cls = type(instance)
+		if self.version == None or instance.pk not in self.rows[cls]:
+			return False
+		names, attnames = fieldNames(cls)
+		versionIndex = attnames.index("space_version")
+		old, new = self.rows[cls][instance.pk], rowOf(instance)
+		return old[:versionIndex] + old[versionIndex+1:] == new[:versionIndex] + new[versionIndex+1:]
+
+	def build(self, cls, ids):
+		"""Fresh State objects for the given ids, in id order"""
+		names, attnames = fieldNames(cls)
+		return [cls.from_db("default", attnames, self.rows[cls][pk]) for pk in sorted(ids)]
+
+	def states(self):
+		with self.lock:
+			return self.build(AnonState, self.rows[AnonState].keys()) + \
+				   self.build(CanonicalState, self.rows[CanonicalState].keys())
+
+	def goals(self):
+		"""The correct states"""
+		with self.lock:
+			goals = []
+			for cls in CLASSES:
+				names, attnames = fieldNames(cls)
+				scoreIndex = attnames.index("score")
+				goals += self.build(cls, [pk for pk in self.rows[cls] if self.rows[cls][pk][scoreIndex] == 1])
+		return goals
+
+	def withCode(self, cls, code):
+		with self.lock:
+			return self.build(cls, self.codes[cls].get(code, []))
+
+def getSpace(problem):
+	"""The problem's solution space, brought up to date"""
+	with spacesLock:
+		if problem.id not in spaces:
+			spaces[problem.id] = SolutionSpace(problem.id)
+		space = spaces[problem.id]
+	with space.lock:
+		space.sync()
+	return space
+
+@receiver(pre_save, sender=AnonState)
+@receiver(pre_save, sender=CanonicalState)
+def stampState(sender, instance, **kwargs):
+	space = spaces.get(instance.problem_id)
+	if space != None:
+		with space.lock:
+			if space.unchanged(instance):
+				return # saving it again doesn't change anything
+	work = currentWork()
+	if work != None:
+		instance.space_version = work.spaceVersion(instance.problem_id)
+		return
+	instance.space_version = bumpVersion(instance.problem_id)
+	instance.stampedAlone = True # see stateSaved
+
+def bumpVersion(problem_id):
+	problems = Problem.objects.filter(id=problem_id)
+	problems.update(space_version=F("space_version") + 1)
+	return problems.values_list("space_version", flat=True).first()
+
+@receiver(post_save, sender=AnonState)
+@receiver(post_save, sender=CanonicalState)
+def stateSaved(sender, instance, **kwargs):
+	if instance.__dict__.pop("stampedAlone", False):
+		# Outside a unit of work, the version was bumped before the state was saved, so another
+		# process may have synced in between; moving it again makes sure it looks once more
+		bumpVersion(instance.problem_id)
+	space = spaces.get(instance.problem_id)
+	if space != None:
+		with space.lock:
+			if space.version != None:
+				space.put(sender, rowOf(instance))
+
+@receiver(post_delete, sender=AnonState)
+@receiver(post_delete, sender=CanonicalState)
+def stateDeleted(sender, instance, **kwargs):
+	work = currentWork()
+	if work != None:
+		work.spaceVersion(instance.problem_id)
+	else:
+		bumpVersion(instance.problem_id)
+	space = spaces.get(instance.problem_id)
+	if space != None:
+		with space.lock:
+			if space.version != None:
+				space.remove(sender, instance.pk)
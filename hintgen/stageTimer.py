@@ -0,0 +1,80 @@
+"""Timers for the stages of a hint request, cheap enough to leave on in production. Each
+request's stage times are attached to its source state (as .timings) and added to per-problem
+histograms in this process. Stages nest, so a stage's time includes the stages inside it
+(generate_cleaned_state includes its test, for example), and a stage that runs more than once
+in a request is summed. Every LOG_EVERY requests, the process writes its histograms to the
+timing log."""
+import bisect, functools, json, os, threading, time
+from .tools import log
+
+BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20] # bucket upper bounds, in seconds
+LOG_EVERY = 500 # requests between writing the histograms to the timing log
+
+current = threading.local()
+histograms = { } # problem id -> stage -> Histogram
+histogramsLock = threading.Lock()
+requestCount = 0
+
+class Histogram:
+	def __init__(self):
+		self.counts = [0] * (len(BUCKETS) + 1) # the last bucket is everything slower than BUCKETS[-1]
+		self.count = 0
+		self.total = 0.0
+
+	def add(self, seconds):
+		self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+		self.count += 1
+		self.total += seconds
+
+	def report(self):
+		labels = ["<=" + str(b) for b in BUCKETS] + [">" + str(BUCKETS[-1])]
+		return { "count" : self.count, "total" : self.total, "buckets" : dict(zip(labels, self.counts)) }
+
+class stage:
+	"""Times a block as part of the current request: with stage("test"): ..."""
+	def __init__(self, name):
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+
+	def __exit__(self, excType, excValue, traceback):
+		timings = getattr(current, "timings", None)
+		if timings != None: # outside a request, there's nowhere to put the time
+			timings[self.name] = timings.get(self.name, 0) + time.perf_counter() - self.start
+
+def timedRequest(f):
+	"""Wraps a function that takes and returns a source state, timing the stages inside it"""
+	@functools.wraps(f)
+	def wrapper(source_state, *args, **kwargs):
+		outer = getattr(current, "timings", None)
+		current.timings = timings = { }
+		start = time.perf_counter()
+		try:
+			source_state = f(source_state, *args, **kwargs)
+		finally:
+			current.timings = outer
+		timings["total"] = time.perf_counter() - start
+		source_state.timings = timings
+		record(source_state.problem_id, timings)
+		return source_state
+	return wrapper
+
+def record(problem_id, timings):
+	global requestCount
+	with histogramsLock:
+		stages = histograms.setdefault(problem_id, { })
+		for (name, seconds) in timings.items():
+			if name not in stages:
+				stages[name] = Histogram()
+			stages[name].add(seconds)
+		requestCount += 1
+		due = requestCount % LOG_EVERY == 0
+	if due:
+		log("Process " + str(os.getpid()) + "\t" + json.dumps(report()), "timing")
+
+def report():
+	"""The histograms as a json-ready object: problem id -> stage -> count, total and buckets"""
+	with histogramsLock:
+		return { str(problem_id) : { name : h.report() for (name, h) in stages.items() }
+				 for (problem_id, stages) in histograms.items() }
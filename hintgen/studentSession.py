@@ -0,0 +1,39 @@
+"""Each student's latest submission to each problem, kept in one small row so that choosing
+a hint level doesn't have to load the student's whole submission history. The row is updated
+whenever a submission is saved."""
+import hashlib
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import SourceState, StudentSession
+
+def codeHash(code):
+	return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+def previousHintLevel(source_state):
+	"""The level of the hint the student just got for this same code, or None if their last
+		submission to the problem was different code or didn't get a hint"""
+	if source_state.student_id == None:
+		return None
+	session = StudentSession.objects.filter(student_id=source_state.student_id, problem_id=source_state.problem_id).first()
+	if session == None or session.last_code_hash != codeHash(source_state.code):
+		return None
+	return session.last_hint_level
+
+@receiver(post_save, sender=SourceState)
+def submissionSaved(sender, instance, created, **kwargs):
+	if not created or instance.student_id == None:
+		return
+	values = { "last_code_hash" : codeHash(instance.code),
+			   "last_hint_level" : instance.hint.level if instance.hint != None else None,
+			   "last_timestamp" : timezone.now() }
+	sessions = StudentSession.objects.filter(student_id=instance.student_id, problem_id=instance.problem_id)
+	if sessions.update(attempts=F("attempts") + 1, **values) == 0:
+		try:
+			with transaction.atomic():
+				StudentSession.objects.create(student_id=instance.student_id, problem_id=instance.problem_id,
+											  attempts=1, **values)
+		except IntegrityError:
+			sessions.update(attempts=F("attempts") + 1, **values) # another process created it first
@@ -1,55 +1,100 @@
 import ast, traceback
 from .testHarness import *
+from .resultCache import lookupResults, storeResult
+from .fixtures import getBundle
 from ..display import *
 from ..namesets import *
 from ..models import *
 
-loaded_pairs = { } # Keep track of pairs for efficiency
-
-def test(s, forceRetest=False):
+def test(s, forceRetest=False, atLeast=None):
 	"""A method for testing solution states, which returns a number between
 		0 (totally wrong) and 1 (correct)"""
-	if forceRetest:
-		if hasattr(s, "loadedFun"):
-			del s.loadedFun
-		s.score = None
-		s.feedback = ""
-	if (s.score != None and s.feedback != ""):
-		return s
+	return test_batch([s], forceRetest, atLeast)[0]
+
+def load_bundle(s, loaded=None):
+	"""Returns the problem's fixture bundle, or None if its tests are broken (the state then gets that feedback).
+		loaded maps problem ids to bundles already checked against the database in this batch."""
+	if loaded == None:
+		loaded = { }
+	if s.problem.id not in loaded:
+		loaded[s.problem.id] = getBundle(s.problem)
+	bundle, msg = loaded[s.problem.id]
+	if bundle == None:
+		s.score = 0
+		s.feedback = msg
+	return bundle
 
-	if s.tree != None:
-		replaceHazards(s.tree)
-		s.code = printFunction(s.tree, 0)
+def test_batch(states, forceRetest=False, atLeast=None):
+	"""Tests many solution states at once. Cached results are looked up in one query,
+		and the rest are scored together, so a batch costs about as much as a single state.
+		If the caller only needs to know which states score at least atLeast, a state's tests stop
+		as soon as it can't; that state keeps a score of None, and its maxScore is set instead."""
+	toRun = { } # fixture bundle -> states that need their results computed
+	loaded = { } # problem id -> (bundle, msg), so each problem is only checked once
+	for s in states:
+		if forceRetest:
+			s.score = None
+			s.feedback = ""
+			s.maxScore = 1
+		if (s.score != None and s.feedback != ""):
+			continue
+		if atLeast != None and not canReach(s, atLeast):
+			continue # we already know the answer
 
-	# If necessary, load the tests
-	if s.problem.id not in loaded_pairs:
-		tests = s.problem.tests.all()
-		for i in range(len(tests)):
-			# Need to interpret from repr
-			try:
-				tests[i].input = eval(tests[i].test_input)
-				tests[i].output = eval(tests[i].test_output)
-			except:
-				s.score = 0
-				if not hasattr(tests[i], "input"):
-					s.feedback = "Broken test case input: " + tests[i].test_input + "\nExpecting a tuple of values."
-				else:
-					s.feedback = "Broken test case output: " + tests[i].test_output + "\nExpecting a legal Python value."
-				return s
-		loaded_pairs[s.problem.id] = tests
+		if s.tree != None:
+			replaceHazards(s.tree)
+			s.code = printFunction(s.tree, 0)
 
-	tests = loaded_pairs[s.problem.id]
-	s.num_pairs = len(tests)
-	try:
-		ast.parse(s.code)
-		s.score, s.feedback = score(s, tests, returnFeedback=True)
-	except Exception as e: # if the code doesn't parse, create a compiler error message
-		s.score = 0
-		trace = traceback.format_exc()
-		lines = trace.split("\n")
-		lines = lines[lines.index("    return compile(source, filename, mode, PyCF_ONLY_AST)")+1:]
-		s.feedback = "COMPILER ERROR:\n" + str("\n".join(lines))
-	return s
+		# If necessary, load the tests
+		bundle = load_bundle(s, loaded)
+		if bundle == None:
+			continue
+		s.num_pairs = bundle.numTests
+		try:
+			ast.parse(s.code)
+		except Exception as e: # if the code doesn't parse, create a compiler error message
+			s.score = 0
+			trace = traceback.format_exc()
+			lines = trace.split("\n")
+			lines = lines[lines.index("    return compile(source, filename, mode, PyCF_ONLY_AST)")+1:]
+			s.feedback = "COMPILER ERROR:\n" + str("\n".join(lines))
+			continue
+		toRun[bundle] = toRun.get(bundle, []) + [s]
+
+	for bundle in toRun:
+		suite = bundle.version
+		# Identical code has probably been tested before, by another student or another process
+		cached = lookupResults([s.code for s in toRun[bundle]], suite)
+		unique = { } # and the same code may show up more than once in a batch
+		for s in toRun[bundle]:
+			if s.code in cached:
+				s.score, s.feedback = cached[s.code].score, cached[s.code].feedback
+			else:
+				unique[s.code] = unique.get(s.code, []) + [s]
+
+		codes = list(unique.keys())
+		results = scoreAll([unique[code][0] for code in codes], bundle, atLeast)
+		for (code, (result, outcomes)) in zip(codes, results):
+			if result == None: # cut short, so there's no score or feedback to give
+				for s in unique[code]:
+					s.maxScore = unique[code][0].maxScore
+				continue
+			msg = renderFeedback(outcomes) # the text is only built once per distinct code
+			for s in unique[code]:
+				s.score, s.feedback = result, msg
+				if type(outcomes) == list:
+					s.test_results = outcomes
+			# Results that depend on how busy the machine is shouldn't be kept around
+			if not isTransient(outcomes):
+				storeResult(code, suite, result, msg)
+		bundle.record([outcomes for (result, outcomes) in results if type(outcomes) == list])
+	return states
+
+def canReach(s, atLeast):
+	"""Whether the state might score at least atLeast, as far as we know"""
+	if s.score != None:
+		return s.score >= atLeast - SCORE_TOLERANCE
+	return getattr(s, "maxScore", 1) >= atLeast - SCORE_TOLERANCE
 
 def replaceHazards(a):
 	if not isinstance(a, ast.AST):
@@ -0,0 +1,60 @@
+"""Deterministic execution budgets for student code. A wall-clock timer fails correct but
+slow code whenever the server is busy; counting the steps the code takes doesn't."""
+import signal, sys
+
+STUDENT_FILE = "<student_code>" # the filename student code is compiled with
+GRACE_TIME = 0.01 # how long code that caught BudgetExceeded gets to stop before onOverrun is called
+
+class BudgetExceeded(BaseException):
+	"""Not an Exception, so student code catching Exception won't swallow it. A bare except
+		still can, and Python stops tracing once it's raised, so check StepCounter.exceeded too,
+		and give the counter an onOverrun for code that never stops."""
+	pass
+
+def budgetMessage(budget):
+	return "Infinite loop! Code ran for more than " + str(budget) + " steps"
+
+class StepCounter:
+	"""Counts every line and call executed by student code, and stops the code once it goes
+		over budget. Frames from anywhere else (the harness, libraries) aren't traced at all.
+		A budget of None turns the counter off. Once the budget is gone, exceeded stays set
+		even if the student code caught the BudgetExceeded and went on without a limit. If the code
+		is still running GRACE_TIME seconds later, onOverrun is called from a SIGALRM handler,
+		which gets in between any two bytecodes; it should report the result and end the process."""
+	def __init__(self, budget, onOverrun=None):
+		self.budget = budget
+		self.steps = 0
+		self.exceeded = False
+		self.onOverrun = onOverrun
+
+	def __enter__(self):
+		if self.budget != None:
+			sys.settrace(self.traceCall)
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		if self.budget != None:
+			sys.settrace(None)
+		if self.exceeded and self.onOverrun != None:
+			signal.setitimer(signal.ITIMER_REAL, 0)
+		return False
+
+	def traceCall(self, frame, event, arg):
+		if frame.f_code.co_filename != STUDENT_FILE:
+			return None
+		self.step()
+		return self.traceLine
+
+	def traceLine(self, frame, event, arg):
+		if event == "line":
+			self.step()
+		return self.traceLine
+
+	def step(self):
+		self.steps += 1
+		if self.steps > self.budget:
+			if not self.exceeded and self.onOverrun != None:
+				signal.signal(signal.SIGALRM, lambda signum, frame : self.onOverrun())
+				signal.setitimer(signal.ITIMER_REAL, GRACE_TIME)
+			self.exceeded = True
+			raise BudgetExceeded()
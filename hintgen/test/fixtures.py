@@ -0,0 +1,135 @@
+"""Compiled test fixtures. A problem's test cases are evaluated, rendered, hashed and pickled
+once per process, and that bundle is reused for every submission to the problem. Sandbox
+workers get the pickled bundle the first time they see its version, and keep it in the
+problem's zygote after that. Problems can be edited by any process, so the bundle's version
+is checked against the database once for each Problem instance, which means once per request.
+Edits made in this process drop the bundle right away."""
+import pickle, threading
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .resultCache import suiteHash
+from .results import shortRepr, SKIPPED
+from ..models import Problem, Testcase
+
+bundles = { } # problem id -> FixtureBundle
+REORDER_EVERY = 100 # submissions tested between re-sorting a bundle's tests by how often they fail
+
+class FixtureBundle:
+	def __init__(self, problem, testcases, tests):
+		self.problem_id = problem.id
+		self.tests = tests # (input, output, extra) triples, already evaluated
+		self.numTests = len(tests)
+		# Every child of a zygote starts from pristine inputs, so these stay accurate
+		# without copying the inputs before each test
+		self.inputReprs = [shortRepr(input) for (input, output, extra) in tests]
+		self.expectedReprs = [shortRepr(output) for (input, output, extra) in tests]
+		# The version changes whenever anything that can change a result does
+		self.version = suiteHash(problem.name, problem.given_code, problem.step_budget,
+								 [(t.test_input, t.test_output, t.test_extra) for t in testcases])
+		self.given_code = problem.given_code
+		self.step_budget = problem.step_budget
+		self.ids = [t.id for t in testcases]
+		self.runCounts = [t.times_run for t in testcases]
+		self.failCounts = [t.times_failed for t in testcases]
+		self.unsaved = ([0] * self.numTests, [0] * self.numTests) # runs and failures not in the database yet
+		self.sinceReorder = 0
+		self.lock = threading.Lock()
+		self.reorder()
+
+	def reorder(self):
+		"""Puts the tests that fail most often first, so that a run that only needs to know
+			whether a score is high enough can stop sooner. Ties keep the database order."""
+		rate = lambda i : (self.failCounts[i] + 1) / (self.runCounts[i] + 2)
+		order = sorted(range(self.numTests), key=lambda i : -rate(i))
+		# Zygotes hold the order too, so a new order needs a new key
+		key = self.version + ":" + ",".join(str(i) for i in order)
+		payload = pickle.dumps((self.given_code, self.tests, self.inputReprs, self.expectedReprs, order))
+		self.layout = (key, payload, order) # replaced all at once, since runs read it without the lock
+		self.sinceReorder = 0
+
+	def record(self, outcomeLists):
+		"""Adds the outcomes of a batch of runs to the tests' statistics. They're only written
+			to the database when the tests are reordered, to keep writes off the hint path."""
+		if len(outcomeLists) == 0:
+			return
+		runs = [0] * self.numTests
+		fails = [0] * self.numTests
+		for outcomes in outcomeLists:
+			for outcome in outcomes:
+				if outcome.kind != SKIPPED:
+					runs[outcome.index] += 1
+					if not outcome.passed():
+						fails[outcome.index] += 1
+		with self.lock:
+			(unsavedRuns, unsavedFails) = self.unsaved
+			for i in range(self.numTests):
+				self.runCounts[i] += runs[i]
+				self.failCounts[i] += fails[i]
+				unsavedRuns[i] += runs[i]
+				unsavedFails[i] += fails[i]
+			self.sinceReorder += len(outcomeLists)
+			if self.sinceReorder < REORDER_EVERY:
+				return
+			self.reorder()
+			self.unsaved = ([0] * self.numTests, [0] * self.numTests)
+		with transaction.atomic():
+			for i in range(self.numTests):
+				if unsavedRuns[i] > 0:
+					Testcase.objects.filter(id=self.ids[i]).update(times_run=F("times_run") + unsavedRuns[i],
+																   times_failed=F("times_failed") + unsavedFails[i])
+
+	def __len__(self):
+		return self.numTests
+
+def buildBundle(problem):
+	"""Returns the problem's bundle (or None) and an error message for broken test cases"""
+	testcases = list(problem.tests.all())
+	tests = []
+	for t in testcases:
+		# Need to interpret from repr
+		try:
+			input = eval(t.test_input)
+		except:
+			return None, "Broken test case input: " + t.test_input + "\nExpecting a tuple of values."
+		try:
+			output = eval(t.test_output)
+		except:
+			return None, "Broken test case output: " + t.test_output + "\nExpecting a legal Python value."
+		tests.append((input, output, t.test_extra))
+	return FixtureBundle(problem, testcases, tests), ""
+
+def currentVersion(problem):
+	"""The suite hash of the problem as the database has it right now, from one small query"""
+	rows = Problem.objects.filter(id=problem.id).order_by("tests__id").values_list(
+		"name", "given_code", "step_budget", "tests__test_input", "tests__test_output", "tests__test_extra")
+	rows = list(rows)
+	if len(rows) == 0:
+		return None
+	(name, given_code, step_budget) = rows[0][:3]
+	return suiteHash(name, given_code, step_budget, [row[3:] for row in rows if row[3] != None])
+
+def getBundle(problem):
+	bundle = bundles.get(problem.id)
+	if bundle != None and getattr(problem, "checkedBundle", None) is bundle:
+		return bundle, "" # already checked for this instance
+	if bundle == None or bundle.version != currentVersion(problem):
+		# Build from a fresh copy of the problem, in case this one was loaded before the edit
+		fresh = Problem.objects.filter(id=problem.id).first() or problem
+		bundle, msg = buildBundle(fresh)
+		if bundle == None:
+			return None, msg
+		bundles[problem.id] = bundle
+	problem.checkedBundle = bundle
+	return bundle, ""
+
+@receiver(post_save, sender=Testcase)
+@receiver(post_delete, sender=Testcase)
+def testcaseChanged(sender, instance, **kwargs):
+	bundles.pop(instance.problem_id, None)
+
+@receiver(post_save, sender=Problem)
+@receiver(post_delete, sender=Problem)
+def problemChanged(sender, instance, **kwargs):
+	bundles.pop(instance.id, None)
@@ -0,0 +1,44 @@
+"""A persistent cache of test results, shared by every process that uses the database.
+Results are addressed by content: the hash of the (normalized) code together with the hash
+of everything else that can change a result, so editing a problem's tests or given code
+simply stops old entries from matching."""
+import hashlib
+from django.db import IntegrityError, transaction
+from .testHarness import TIMEOUT_MODE
+from ..models import TestResult
+
+def codeHash(code):
+	return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+def suiteHash(name, given_code, step_budget, tests):
+	"""Identifies the problem's function name, given code, step budget, and test cases,
+		which are (test_input, test_output, test_extra) triples"""
+	h = hashlib.sha256()
+	budget = str(step_budget) if TIMEOUT_MODE == "budget" else "wall"
+	parts = [name, given_code, budget]
+	parts += [repr(tuple(t)) for t in tests]
+	for part in parts:
+		h.update(part.encode("utf-8"))
+		h.update(b"\0")
+	return h.hexdigest()
+
+def lookupResult(code, suite):
+	return lookupResults([code], suite).get(code)
+
+def lookupResults(codes, suite):
+	"""Finds the cached results for many pieces of code in one query. Returns a dictionary mapping code to result."""
+	hashes = { }
+	for code in codes:
+		hashes[codeHash(code)] = code
+	found = { }
+	for result in TestResult.objects.filter(code_hash__in=list(hashes.keys()), suite_hash=suite):
+		found[hashes[result.code_hash]] = result
+	return found
+
+def storeResult(code, suite, score, feedback):
+	try:
+		with transaction.atomic():
+			TestResult.objects.get_or_create(code_hash=codeHash(code), suite_hash=suite,
+											 defaults={ "score" : score, "feedback" : feedback })
+	except IntegrityError:
+		pass # another process stored the same result first
@@ -0,0 +1,80 @@
+"""Structured test results. A sandbox worker sends each test's outcome back as one small
+tuple frame; the feedback text students see is only rendered from these when it's needed."""
+
+REPR_LENGTH = 400 # reprs are cut down before they're sent; feedback only shows the first 100 characters
+
+PASSED = "passed"
+FAILED = "failed" # the function returned the wrong answer
+ERROR = "error" # the function raised an exception
+TIMEOUT = "timeout" # the function ran out of steps inside the worker
+BROKEN = "broken" # the worker timed out or died, so the parent filled this one in
+SKIPPED = "skipped" # too many tests timed out before this one
+
+def shortRepr(x):
+	r = repr(x)
+	return r if len(r) <= REPR_LENGTH else r[:REPR_LENGTH]
+
+class TestOutcome:
+	"""The result of running a single test case"""
+	__slots__ = ["index", "kind", "input", "expected", "actual", "errorType", "message", "elapsed"]
+
+	def __init__(self, index, kind, input="", expected="", actual="", errorType="", message="", elapsed=0):
+		self.index = index
+		self.kind = kind
+		self.input = input # reprs, not values, so they can always be sent back
+		self.expected = expected
+		self.actual = actual
+		self.errorType = errorType
+		self.message = message
+		self.elapsed = elapsed
+
+	def passed(self):
+		return self.kind == PASSED
+
+	def timedOut(self):
+		"""Whether the test ran out of steps or time. A test that crashed its worker didn't."""
+		return self.kind == TIMEOUT or (self.kind == BROKEN and self.message.startswith("Infinite loop!"))
+
+	def frame(self):
+		return (self.index, self.kind, self.input, self.expected, self.actual, self.errorType, self.message, self.elapsed)
+
+	@staticmethod
+	def fromFrame(frame):
+		return TestOutcome(*frame)
+
+	def line(self, msg_length=400):
+		"""The feedback line for this test"""
+		if self.kind == PASSED:
+			s = "Test passed on input (" + showRepr(self.input, 97, "...")[1:-1] + "), expected output " + showRepr(self.expected, 97, "...")
+		elif self.kind == FAILED:
+			a = self.actual if len(self.actual) < 100 else self.actual[:97] + "..."
+			s = "Failed assertion: given input (" + showRepr(self.input, 96, "...]")[1:-1] + "), expected output " + \
+				showRepr(self.expected, 97, "...") + ", actual output " + a # 364
+		elif self.kind == ERROR:
+			i = self.input if len(self.input) < 100 else self.input[:97] + "..."
+			emsg = self.message if len(self.message) < 100 else self.message[:97] + "..."
+			s = "Test function with input (" + i[1:-1] + ") broke with error: " + emsg # 245
+		elif self.kind == SKIPPED:
+			s = "Test skipped on input (" + inputString(self.input) + ") after " + self.message
+		else: # TIMEOUT and BROKEN
+			s = self.message + " on input (" + inputString(self.input) + ")"
+		return (s + "\n")[:msg_length]
+
+def showRepr(r, cut, ending):
+	r = r if len(r) < 100 else r[:cut] + ending
+	return r[1:] if (r[0] == 'u' and r[1] == "'" and r[-1] == "'") else r
+
+def inputString(r):
+	r = r if len(r) < 100 else r[:97] + "..."
+	return r[1:-1]
+
+def renderFeedback(outcomes):
+	"""Turns a list of outcomes into the feedback text. Anything else (an error message) is already text."""
+	if type(outcomes) != list:
+		return outcomes
+	return "".join(outcome.line() for outcome in outcomes)
+
+def passedFraction(outcomes, numTests):
+	if type(outcomes) != list:
+		return 0
+	return len([outcome for outcome in outcomes if outcome.passed()]) / numTests
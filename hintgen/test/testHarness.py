@@ -1,190 +1,126 @@
-import copy, ctypes, multiprocessing, os, random, io, sys, threading, time, ast
-import importlib.util
+import copy, time, ast
+from .budget import BudgetExceeded, StepCounter, budgetMessage
+from .results import *
+from .workerPool import getPool, recvAll
+from .zygote import getZygote
 from ..tools import log
-from ..paths import TEST_PATH
 
-done = False
 msg_length = 400
 
-def timerDone():
-	global done
-	done = True
-
-def manageException(e, errors, input, output, actual):
-	if type(e) == AssertionError:
-		i = repr(input)
-		i = i if len(i) < 100 else i[:96] + "...]"
-		i = i[1:] if (i[0] == 'u' and i[1] == "'" and i[-1] == "'") else i
-		o = repr(output)
-		o = o if len(o) < 100 else o[:97] + "..."
-		o = o[1:] if (o[0] == 'u' and o[1] == "'" and o[-1] == "'") else o
-		a = repr(actual)
-		a = a if len(a) < 100 else a[:97] + "..."
-		errors.append("Failed assertion: given input (" + i[1:-1] + "), expected output " + o + ", actual output " + a ) # 364
-	else:
-		i = repr(input)
-		i = i if len(i) < 100 else i[:97] + "..."
-		emsg = str(e)
-		emsg = emsg if len(emsg) < 100 else emsg[:97] + "..."
-		errors.append("Test function with input (" + i[1:-1] + ") broke with error: " + emsg) # 245
+# In "budget" mode, student code is stopped after the problem's step_budget steps, and the
+# wall-clock timer only backs that up (for code that loops inside a builtin, for example).
+# In "wall" mode, the wall-clock timers are all there is.
+TIMEOUT_MODE = "budget"
+LOAD_TIME = 0.1
+TEST_TIME = 0.1
+BACKSTOP_TIME = 0.5
+SCORE_TOLERANCE = 0.001 # scores this close together count as the same
+ZYGOTE_SLACK = 0.5 # the zygote enforces the timers itself, so the parent gives it a little longer
+MAX_TIMEOUTS = 2 # after this many tests time out, the remaining tests are skipped
+
+def isTransient(outcomes):
+	"""Wall-clock timeouts and crashed workers depend on how busy the machine is"""
+	if type(outcomes) == list:
+		return any(outcome.kind == BROKEN for outcome in outcomes)
+	return outcomes.startswith("Infinite loop! Code timed out") or outcomes == "Broken Process"
 
 def checkCopy(f, input):
 	cp = copy.deepcopy(input)
 	f(*cp)
 	return cp == input
 
-def load_file(tmpFile, tmpFull):
-	failed = False
-	# Then try to load the function
-	try:
-		spec = importlib.util.spec_from_file_location(tmpFile, tmpFull + ".py")
-		mod = importlib.util.module_from_spec(spec)
-		spec.loader.exec_module(mod)
-	except Exception as e:
-		mod = None
-		failed = True
-	return mod, failed
-
-def textToFunction(s):
-	if s.loadedFun != None:
-		return s.loadedFun
-	instructorFunctions = s.problem.given_code
-	# Create a file that can be loaded, with the function in it
-	tmpFile = "tmp" + str(random.randint(0,100000))
-	tmpPath = TEST_PATH + "tmp"
-	tmpFull = tmpPath + "/" + tmpFile
-	tmpCache = tmpPath + "/" + "__pycache__" + "/" + tmpFile
-	try:
-		f = open(tmpFull + ".py", "w")
-	except:
-		s.feedback = "ERROR: could not write file, please change permissions in the test/tmp folder"
-		return None
-	# Set this up to look like Python 3
-	#f.write("from __future__ import (absolute_import, division, print_function)\n")
-	f.write(s.code)
-	if len(instructorFunctions) != 0:
-		f.write("\n\n" + instructorFunctions)
-	f.close()
-
-	# Try loading the file in a timed thread in case the file calls infinitely-looping code
-	p = multiprocessing.Process(target=load_file, args=(tmpFile, tmpFull))
-	result = run_in_timer(p, 0.1)
-	if result != "Success":
-		log("testHarness\ttextToFunction\tTimer problem: " + result + "\n" + s.code, "bug")
-		s.feedback = result
-		return None
-	else:
-		out = sys.stdout
-		err = sys.stderr
-		sys.stdout = io.StringIO()
-		sys.stderr = io.StringIO()
-		mod, failed = load_file(tmpFile, tmpFull)
-		sys.stdout = out
-		sys.stderr = err
-
-	# Clean up the extra files
-	if os.path.exists(tmpFull + ".py"):
-		os.remove(tmpFull + ".py")
-	if os.path.exists(tmpFull + ".pyc"):
-		os.remove(tmpFull + ".pyc")
-	for version in range(10): # Python 3 caches in a separate folder and includes the version number
-		name = tmpCache + ".cpython-3" + str(version) + ".pyc"
-		if os.path.exists(name):
-			os.remove(name)
-	
-	if failed:
-		s.feedback = "ERROR: could not load function, possibly due to compiler error in instructorFunctions"
-		return None
-
-	# Load the resulting function from the file. It will have references to all necessary helpers
-	if hasattr(mod, s.problem.name):
-		loaded = getattr(mod, s.problem.name)
-		s.loadedFun = loaded
-	else:
-		s.feedback = "ERROR: could not find required function in code"
-		return None
-
-	return s.loadedFun
-
 def __genericTest__(f, input, output):
-	errors = []
+	"""Returns the actual output and the exception that was raised (or None)"""
 	answer = None
-	input_copy = copy.deepcopy(input)
 	try:
 		answer = f(*input)
 		if type(output) == float:
 			assert(abs(answer - output) < 0.001)
 		else:
 			assert(answer == output)
-	except Exception as e:
-		manageException(e, errors, input_copy, output, answer)
-	return errors
-
-def runFunction(s, tests, score, feedback=None):
-	f = textToFunction(s) # first, load the function
-	for i in range(len(tests)):
-		test = tests[i]
-		if test.test_extra == "check_copy":
-			inp = [f] + [test.input]
-		elif test.test_extra == "":
-			inp = test.input
-		else:
-			log("testHarness\trunFunction\tDid not recognize special function " + test.test_extra, "bug")
-			return
-
-		input_copy = copy.deepcopy(inp)
-		errors = __genericTest__(f, inp, test.output)
-		if len(errors) == 0: # if no problems occurred
-			score.value = score.value + 1
-			inp = repr(input_copy)
-			inp = inp if len(inp) < 100 else inp[:97] + "..."
-			inp = inp[1:] if (inp[0] == 'u' and inp[1] == "'" and inp[-1] == "'") else inp
-			o = repr(test.output)
-			o = o if len(o) < 100 else o[:97] + "..."
-			o = o[1:] if (o[0] == 'u' and o[1] == "'" and o[-1] == "'") else o
-			s = "Test passed on input (" + inp[1:-1] + "), expected output " + o + "\n" # 240
-		else:
-			s = errors[0] + "\n"
-		if feedback != None:
-			for j in range(len(s)):
-				feedback[i*msg_length + j] = ord(s[j]) # add the string into the array
-
-def run_in_timer(proc, timerTime):
-	global done
-	out = sys.stdout
-	err = sys.stderr
-	sys.stdout = io.StringIO()
-	sys.stderr = io.StringIO()
-	timer = threading.Timer(timerTime, timerDone)
-	timeout = False
+	except (Exception, SystemExit) as e: # exiting is just another error, not a broken worker
+		return answer, e
+	return answer, None
+
+def runSubmission(key, payload, code, name, budget, start, timeouts, failures, maxFailures, timerTime):
+	"""The job that runs inside a sandbox worker. The problem's zygote forks a child to test the code in,
+		which first reports whether the code loaded, then sends a TestOutcome frame for each test as soon
+		as it's done, starting from position start in the bundle's test order. Loading and each test get
+		their own step budget (if there is one). Once more than maxFailures tests have failed, the job
+		stops early (None means run everything). payload is the pickled fixture bundle, or None if this
+		worker has seen it before."""
+	zygote = getZygote(key, payload)
+	if zygote == None:
+		yield "Broken Process"
+		return
+	job = lambda start, timeouts, failures : runFunction(zygote, code, name, budget, start, timeouts, failures, maxFailures)
+	for msg in zygote.run(job, start, timeouts, failures, timerTime):
+		yield msg
+
+def runFunction(zygote, code, name, budget, start, timeouts, failures, maxFailures):
+	"""Runs in a child of the zygote"""
+	counter = StepCounter(budget, lambda : zygote.abandon(budgetMessage(budget)))
+	try:
+		with counter:
+			f, msg = zygote.load(code, name) # first, load the function
+	except BudgetExceeded:
+		pass
+	if counter.exceeded: # even if the code caught it and carried on
+		f, msg = None, budgetMessage(budget)
+	if f == None:
+		yield msg
+		return
+	yield "loaded"
+
+	for pos in range(start, len(zygote.order)):
+		if maxFailures != None and failures > maxFailures:
+			break # the answer is already decided
+		outcome = runTest(f, zygote, zygote.order[pos], budget, timeouts)
+		if outcome == None:
+			break
+		if outcome.timedOut():
+			timeouts += 1
+		if not outcome.passed():
+			failures += 1
+		yield outcome.frame()
+
+def runTest(f, zygote, i, budget, timeouts):
+	(input, output, extra) = zygote.tests[i]
+	if timeouts >= MAX_TIMEOUTS:
+		return TestOutcome(i, SKIPPED, input=zygote.inputReprs[i], message=skippedMessage())
+	if extra == "check_copy":
+		inp = [f] + [input]
+		inputRepr = shortRepr(inp)
+	elif extra == "":
+		inp = input
+		inputRepr = zygote.inputReprs[i] # the input hasn't been touched yet in this child
+	else:
+		log("testHarness\trunTest\tDid not recognize special function " + extra, "bug")
+		return None
+
+	startTime = time.perf_counter()
+	overBudget = lambda : TestOutcome(i, TIMEOUT, input=zygote.inputReprs[i], message=budgetMessage(budget),
+									  elapsed=time.perf_counter() - startTime)
+	counter = StepCounter(budget, lambda : zygote.abandon(overBudget().frame()))
 	try:
-		proc.start()
-		timer.start()
-		while (proc.is_alive()) and (not done):
-			continue
-		timer.cancel()
-		# If the process is still running, kill it
-		if proc.is_alive():
-			timeout = True
-			try:
-				proc.terminate()
-				time.sleep(0.01)
-				if proc.is_alive():
-					os.system('kill -9 ' + str(proc.pid))
-			except:
-				log("testHarness\tscore\tThread is still alive!", "bug")
-			while proc.is_alive():
-				time.sleep(0.01)
-		sys.stdout = out
-		sys.stderr = err
-		done = False
-	except Exception as e:
-		log("testHarness\tscore\tBroken process: " + str(e), "bug")
-		return "Broken Process"
-	if timeout:
-		return "Infinite loop! Code timed out after " + str(timerTime) + " seconds"
+		with counter:
+			answer, e = __genericTest__(f, inp, output)
+	except BudgetExceeded:
+		pass
+	if counter.exceeded: # even if the code caught it and carried on
+		return overBudget()
+	elapsed = time.perf_counter() - startTime
+	if e == None:
+		return TestOutcome(i, PASSED, input=inputRepr, expected=zygote.expectedReprs[i], elapsed=elapsed)
+	elif type(e) == AssertionError:
+		return TestOutcome(i, FAILED, input=inputRepr, expected=zygote.expectedReprs[i], actual=shortRepr(answer),
+						   errorType="AssertionError", elapsed=elapsed)
 	else:
-		return "Success"
+		return TestOutcome(i, ERROR, input=inputRepr, expected=zygote.expectedReprs[i], errorType=type(e).__name__,
+						   message=str(e)[:REPR_LENGTH], elapsed=elapsed)
+
+def skippedMessage():
+	return str(MAX_TIMEOUTS) + " tests timed out"
 
 def contains_function(a, problem_name):
 	for line in a.body:
@@ -192,50 +128,163 @@ def contains_function(a, problem_name):
 			return True
 	return False
 
-def score(s, tests, returnFeedback=False):
-	# Note that now, infinite loops will break all test cases that come after that. We're OK with this as long as we order test cases properly.
-	if not hasattr(s, "loadedFun"):
-		if not hasattr(s, "tree") or s.tree == None:
-			try:
-				tmpTree = ast.parse(s.code)
-			except:
-				s.feedback = "Could not load code"
-				return (0, s.feedback) if returnFeedback else 0
+def checkLoadable(s):
+	"""Returns an error message if the state obviously can't be run, or None if it can"""
+	if not hasattr(s, "tree") or s.tree == None:
+		try:
+			tmpTree = ast.parse(s.code)
+		except:
+			return "Could not load code"
+	else:
+		tmpTree = s.tree
+
+	if not contains_function(tmpTree, s.problem.name):
+		return "ERROR: could not find required function in code"
+	return None
+
+def maxFailuresFor(atLeast, numTests):
+	"""The most tests that can fail while the score still reaches atLeast"""
+	if atLeast == None:
+		return None
+	return int(numTests * (1 - atLeast) + SCORE_TOLERANCE * numTests + 1e-9)
+
+class TestRun:
+	"""One state's progress through the tests. If a test times out, the run picks up
+		with the next test in a fresh worker, so the tests before and after it still count.
+		Tests run in the bundle's order (most likely to fail first), but outcomes are kept by test index."""
+	def __init__(self, s, bundle, maxFailures=None):
+		self.s = s
+		self.bundle = bundle
+		# Take these together, since the bundle may be reordered while we're running
+		self.key, self.payload, self.order = bundle.layout
+		self.numTests = bundle.numTests
+		self.maxFailures = maxFailures
+		self.outcomes = []
+		self.next = 0 # the position (in the order) of the next test we're waiting on
+		self.timeouts = 0
+		self.failures = 0
+		self.error = None # set if the code couldn't be loaded; replaces all the feedback
+		self.cutShort = False # set if the run stopped as soon as it couldn't reach the score it needed
+		self.worker = None
+		self.loaded = False
+		s.test_time = 0
+
+	def done(self):
+		return self.error != None or self.next >= self.numTests
+
+	def start(self, pool, timerTime):
+		s = self.s
+		budget = self.bundle.step_budget if TIMEOUT_MODE == "budget" else None
+		self.worker = pool.acquire()
+		if self.key in self.worker.zygotes: # the worker already has these fixtures
+			payload = None
 		else:
-			tmpTree = s.tree
+			payload = self.payload
+			self.worker.zygotes.add(self.key)
+		self.worker.send(runSubmission, (self.key, payload, s.code, s.problem.name, budget, self.next,
+										  self.timeouts, self.failures, self.maxFailures, timerTime))
+		self.loaded = False
+
+	def add(self, outcome):
+		self.outcomes.append(outcome)
+		if not outcome.passed():
+			self.failures += 1
+
+	def update(self, result, payload):
+		"""Handle the worker's next message. Returns True if the worker can't be used any more."""
+		self.s.test_time += self.worker.elapsed
+		if result != "Success":
+			if not self.loaded:
+				log("testHarness\tTestRun\tTimer problem: " + result + "\n" + self.s.code, "bug")
+				self.error = result
+			elif not self.worker.busy and not self.worker.broken:
+				# The job stopped early, so the rest of the tests don't count
+				self.cutShort = self.maxFailures != None and self.failures > self.maxFailures
+				self.next = self.numTests
+			else:
+				# This test timed out or broke the worker; record it and move on to the next one
+				i = self.order[self.next]
+				outcome = TestOutcome(i, BROKEN, input=self.bundle.inputReprs[i], message=result, elapsed=self.worker.elapsed)
+				self.add(outcome)
+				self.next += 1
+				if outcome.timedOut():
+					self.timeouts += 1
+				if self.timeouts >= MAX_TIMEOUTS:
+					for i in self.order[self.next:]:
+						self.add(TestOutcome(i, SKIPPED, input=self.bundle.inputReprs[i], message=skippedMessage()))
+					self.next = self.numTests
+			return True
+		if not self.loaded:
+			if payload == "loaded":
+				self.loaded = True
+			else:
+				self.error = payload
+			return False
+		outcome = TestOutcome.fromFrame(payload)
+		self.add(outcome)
+		if outcome.timedOut():
+			self.timeouts += 1
+		self.next += 1
+		return False
+
+	def result(self):
+		"""The state's score, along with either its outcomes or the message that replaced them.
+			If the run was cut short, the score is None and the state's maxScore says how high it could have gone."""
+		if self.error != None:
+			return (0, self.error)
+		self.outcomes.sort(key=lambda outcome : outcome.index)
+		self.s.test_results = self.outcomes
+		if self.cutShort:
+			self.s.maxScore = (self.numTests - self.failures) / self.numTests
+			return (None, self.outcomes)
+		return (passedFraction(self.outcomes, self.numTests), self.outcomes)
 
-		if contains_function(tmpTree, s.problem.name):
-			s.loadedFun = None
-			s.loadedFun = textToFunction(s)
+def scoreAll(states, bundle, atLeast=None):
+	"""Scores many states against the same fixture bundle. The states are fanned out over the worker pool,
+		so a whole batch costs about as much as a single state. Returns a (score, outcomes) pair for each state,
+		where outcomes is a list of TestOutcomes, or an error message if the tests couldn't be run at all.
+		If atLeast is given, a state's tests stop as soon as its score can't reach atLeast any more;
+		such states get a score of None."""
+	results = [None] * len(states)
+	maxFailures = maxFailuresFor(atLeast, bundle.numTests)
+	runs = { }
+	for i in range(len(states)):
+		msg = checkLoadable(states[i])
+		if msg != None:
+			results[i] = (0, msg)
 		else:
-			s.feedback = "ERROR: could not find required function in code"
-			return (0, s.feedback) if returnFeedback else 0
-	f = s.loadedFun
+			runs[i] = TestRun(states[i], bundle, maxFailures)
+	waiting = [runs[i] for i in sorted(runs)]
 
-	if f == None:
-		return (0, s.feedback) if returnFeedback else 0
+	# Every message gets its own timer, whether it reports loading or a single test
+	timerTime = BACKSTOP_TIME if TIMEOUT_MODE == "budget" else max(LOAD_TIME, TEST_TIME)
+	pool = getPool()
+	active = []
+	try:
+		while len(waiting) > 0 or len(active) > 0:
+			while len(waiting) > 0 and len(active) < pool.size:
+				run = waiting.pop(0)
+				run.start(pool, timerTime)
+				active.append(run)
+			messages = recvAll([run.worker for run in active], timerTime + ZYGOTE_SLACK)
+			for (run, (result, payload)) in zip(active[:], messages):
+				finished = run.update(result, payload)
+				if finished or run.done():
+					pool.release(run.worker)
+					run.worker = None
+					active.remove(run)
+					if not run.done(): # pick up where the last worker left off
+						waiting.append(run)
+	finally:
+		for run in active:
+			pool.release(run.worker)
 
-	score = multiprocessing.Value(ctypes.c_float, 0.0, lock=False)
-	if returnFeedback:
-		# Allocate 250 chars for each feedback line
-		feedback = multiprocessing.Array(ctypes.c_int, msg_length * len(tests), lock=False)
-		p = multiprocessing.Process(target=runFunction, args=(s, tests, score, feedback))
-	else:
-		p = multiprocessing.Process(target=runFunction, args=(s, tests, score))
-	
-	test_result = run_in_timer(p, 0.1)
-	if test_result != "Success":
-		#log("testHarness\tscore\tTimer problem: " + test_result, "bug")
-		result = 0
-		msg = test_result
-	else:
-		if returnFeedback:
-			msg = ""
-			for i in range(len(tests)):
-				j = 0
-				while j < msg_length and feedback[i*msg_length + j] != 0:
-					msg += chr(int(feedback[i*msg_length + j]))
-					j += 1
-		result = score.value / len(tests)
-	return (result, msg) if returnFeedback else result
+	for i in runs:
+		results[i] = runs[i].result()
+	return results
 
+def score(s, bundle, returnFeedback=False):
+	# Note that now, infinite loops will break all test cases that come after that. We're OK with this as long as we order test cases properly.
+	result, outcomes = scoreAll([s], bundle)[0]
+	s.feedback = renderFeedback(outcomes)
+	return (result, s.feedback) if returnFeedback else result
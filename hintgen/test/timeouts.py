@@ -0,0 +1,47 @@
+"""Timeout supervision for sandbox workers. Everything here blocks in the OS (on the
+workers' pipes and process sentinels) instead of spinning, and keeps its state in
+Timer objects instead of globals, so any number of executions can be supervised at
+once, from one thread or from many."""
+import time
+from multiprocessing.connection import wait
+
+class Timer:
+	"""The time budget of a single supervised execution"""
+	def __init__(self, timerTime):
+		self.timerTime = timerTime
+		self.start = time.perf_counter()
+
+	def elapsed(self):
+		return time.perf_counter() - self.start
+
+	def remaining(self):
+		return max(0, self.timerTime - self.elapsed())
+
+	def expired(self):
+		return self.remaining() == 0
+
+def waitForAny(watched):
+	"""Takes a dictionary mapping each supervised object to a (conn, sentinel, timer) triple.
+		Blocks until at least one of them has a message waiting, has died, or has run out of time,
+		then returns the list of those objects."""
+	if len(watched) == 0:
+		return []
+	while True:
+		handles = { }
+		timeout = None
+		expired = []
+		for key in watched:
+			(conn, sentinel, timer) = watched[key]
+			remaining = timer.remaining()
+			if remaining == 0:
+				expired.append(key)
+			timeout = remaining if timeout == None else min(timeout, remaining)
+			handles[conn] = key
+			handles[sentinel] = key
+		ready = wait(list(handles.keys()), timeout=timeout)
+		if len(ready) > 0 or len(expired) > 0:
+			found = expired[:]
+			for handle in ready:
+				if handles[handle] not in found:
+					found.append(handles[handle])
+			return found
@@ -0,0 +1,195 @@
+"""A pool of pre-forked sandbox processes which the test harness dispatches jobs to.
+Forking a fresh process for every test run is by far the most expensive part of testing,
+so workers are kept alive between jobs and only replaced when they time out, crash,
+or have run too many jobs (student code can leave garbage behind in the interpreter)."""
+import io, multiprocessing, os, signal, sys, threading
+from .timeouts import Timer, waitForAny
+from .zygote import stopWorker
+from ..tools import log
+
+POOL_SIZE = 4 # number of idle workers kept around
+MAX_JOBS_PER_WORKER = 50 # recycle a worker after it has run this many jobs
+
+class Worker:
+	"""A single sandbox process. Jobs are generator functions; every value they yield
+		is sent back to the parent, so a job can report its progress in stages."""
+	def __init__(self):
+		self.conn, childConn = multiprocessing.Pipe()
+		self.proc = multiprocessing.Process(target=workerLoop, args=(childConn,))
+		self.proc.daemon = True
+		self.proc.start()
+		childConn.close() # only the child should hold this end
+		self.jobs = 0
+		self.busy = False
+		self.broken = False
+		self.elapsed = 0
+		self.zygotes = set() # the problems this worker has a zygote for
+
+	def send(self, f, args):
+		self.jobs += 1
+		self.busy = True
+		self.conn.send((f, args))
+
+	def collect(self, timer):
+		"""Read the job's next message once a wait has returned. By then, the job has either
+			sent something, died, or run out of time."""
+		self.elapsed = timer.elapsed()
+		try:
+			if self.conn.poll():
+				kind, payload = self.conn.recv()
+			elif not timer.expired(): # the wait ended early, so the process must have died
+				self.kill()
+				log("workerPool\tcollect\tWorker died with exit code " + str(self.proc.exitcode), "bug")
+				return "Broken Process", None
+			else:
+				self.kill()
+				return "Infinite loop! Code timed out after " + str(timer.timerTime) + " seconds", None
+		except (EOFError, OSError) as e:
+			log("workerPool\tcollect\tWorker died: " + str(e), "bug")
+			self.kill()
+			return "Broken Process", None
+		if kind == "msg":
+			return "Success", payload
+		self.busy = False
+		if kind == "error":
+			log("workerPool\tcollect\tJob broke: " + str(payload), "bug")
+			self.broken = True
+		return "Broken Process", None
+
+	def recv(self, timerTime):
+		"""Wait for the next message from the current job. Returns a (result, payload) pair,
+			where result is "Success" unless the job timed out or broke."""
+		if not self.busy:
+			return "Broken Process", None
+		timer = Timer(timerTime)
+		waitForAny({ self : (self.conn, self.proc.sentinel, timer) })
+		return self.collect(timer)
+
+	def finish(self, timerTime=0.1):
+		"""Read until the current job is done, so that the next job starts with a clean pipe"""
+		while self.busy and not self.broken:
+			self.recv(timerTime)
+
+	def kill(self):
+		self.busy = False
+		self.broken = True
+		try:
+			self.proc.terminate()
+			self.proc.join(0.01)
+			if self.proc.is_alive():
+				os.kill(self.proc.pid, 9)
+			self.proc.join()
+		except Exception as e:
+			log("workerPool\tkill\tWorker is still alive! " + str(e), "bug")
+		self.conn.close()
+
+	def stop(self):
+		try:
+			self.conn.send(None)
+			self.proc.join(0.1)
+		except (EOFError, OSError):
+			pass
+		if self.proc.is_alive():
+			self.kill()
+		else:
+			self.conn.close()
+
+def workerLoop(conn):
+	signal.signal(signal.SIGTERM, stopWorker)
+	out = sys.stdout
+	err = sys.stderr
+	while True:
+		try:
+			job = conn.recv()
+		except (EOFError, KeyboardInterrupt):
+			break
+		if job == None:
+			break
+		f, args = job
+		# Hide anything the student code prints
+		sys.stdout = io.StringIO()
+		sys.stderr = io.StringIO()
+		try:
+			for msg in f(*args):
+				conn.send(("msg", msg))
+			done = ("done", None)
+		except BaseException as e: # SystemExit and friends should not take the worker down mid-job
+			done = ("error", type(e).__name__ + ": " + str(e))
+		sys.stdout = out
+		sys.stderr = err
+		conn.send(done)
+	conn.close()
+
+def recvAll(workers, timerTime):
+	"""Supervise the current jobs of many workers at once, all sharing the same time budget.
+		Returns a (result, payload) pair for each worker, in order."""
+	timer = Timer(timerTime)
+	results = [None] * len(workers)
+	waiting = { }
+	for i in range(len(workers)):
+		if workers[i].busy:
+			waiting[workers[i]] = (workers[i].conn, workers[i].proc.sentinel, timer)
+		else:
+			results[i] = ("Broken Process", None)
+	while len(waiting) > 0:
+		for worker in waitForAny(waiting):
+			results[workers.index(worker)] = worker.collect(timer)
+			del waiting[worker]
+	return results
+
+class WorkerPool:
+	def __init__(self, size=POOL_SIZE, maxJobs=MAX_JOBS_PER_WORKER):
+		self.size = size
+		self.maxJobs = maxJobs
+		self.idle = []
+		self.lock = threading.Lock()
+		self.pid = os.getpid()
+
+	def start(self):
+		"""Pre-fork the workers so that the first requests don't pay for it"""
+		with self.lock:
+			while len(self.idle) < self.size:
+				self.idle.append(Worker())
+
+	def acquire(self):
+		with self.lock:
+			while len(self.idle) > 0:
+				worker = self.idle.pop()
+				if worker.proc.is_alive():
+					return worker
+				worker.kill()
+		# Every worker is busy, so we need a new one
+		return Worker()
+
+	def release(self, worker):
+		worker.finish()
+		with self.lock:
+			if not worker.broken and worker.jobs < self.maxJobs and len(self.idle) < self.size:
+				self.idle.append(worker)
+				return
+		if worker.broken:
+			worker.kill()
+		else:
+			worker.stop()
+		# Replace recycled workers right away so that the pool stays warm
+		with self.lock:
+			if len(self.idle) < self.size:
+				self.idle.append(Worker())
+
+	def shutdown(self):
+		with self.lock:
+			workers, self.idle = self.idle, []
+		for worker in workers:
+			worker.stop()
+
+pool = None
+poolLock = threading.Lock()
+
+def getPool():
+	"""Each process gets its own pool; a forked child can't use its parent's workers"""
+	global pool
+	with poolLock:
+		if pool == None or pool.pid != os.getpid():
+			pool = WorkerPool()
+			pool.start()
+		return pool
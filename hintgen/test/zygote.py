@@ -0,0 +1,177 @@
+"""Per-problem zygotes. A sandbox worker runs the problem's given_code and unpacks its tests
+once, then forks a copy-on-write child for each submission. The child only has to execute
+the student's definitions, and whatever the student code does to the namespace disappears
+with the child. The zygote also supervises its children: when one times out or dies, the
+zygote reports that test as broken and forks a new child for the rest of the tests, so the
+worker itself stays warm."""
+import multiprocessing, os, pickle, signal, types
+from .budget import STUDENT_FILE
+from .results import TestOutcome, BROKEN
+from .timeouts import Timer
+from ..tools import log
+
+LOAD_ERROR = "ERROR: could not load function, possibly due to compiler error in instructorFunctions"
+
+zygotes = { } # problem key -> Zygote, in this worker process only
+child = None # the pid of the child that's currently running
+childConn = None # in a child, the pipe back to the zygote
+
+class Zygote:
+	def __init__(self, payload):
+		instructorFunctions, self.tests, self.inputReprs, self.expectedReprs, self.order = pickle.loads(payload)
+		self.positions = { } # test index -> where it comes in the order
+		for pos in range(len(self.order)):
+			self.positions[self.order[pos]] = pos
+		self.module = types.ModuleType("student_code")
+		self.error = None
+		if len(instructorFunctions) != 0:
+			try:
+				exec(compile(instructorFunctions, STUDENT_FILE, "exec"), self.module.__dict__)
+			except Exception as e:
+				self.error = LOAD_ERROR
+		# The given code used to be appended to the student's code, so its definitions win
+		self.given = dict(self.module.__dict__)
+
+	def load(self, code, name):
+		"""Loads the student's function into the zygote's namespace. Only call this in a child!
+			Returns the function (or None) and an error message."""
+		if self.error != None:
+			return None, self.error
+		namespace = self.module.__dict__
+		try:
+			exec(compile(code, STUDENT_FILE, "exec"), namespace)
+		except (Exception, SystemExit) as e:
+			return None, LOAD_ERROR
+		namespace.update(self.given)
+		if name in namespace:
+			return namespace[name], ""
+		else:
+			return None, "ERROR: could not find required function in code"
+
+	def fork(self, job, start, timeouts, failures):
+		"""Runs job(start, timeouts, failures) in a new child, which sends everything the job yields down a pipe"""
+		global child, childConn
+		readConn, writeConn = multiprocessing.Pipe(duplex=False)
+		pid = os.fork()
+		if pid == 0:
+			signal.signal(signal.SIGTERM, signal.SIG_DFL)
+			readConn.close()
+			childConn = writeConn
+			try:
+				for msg in job(start, timeouts, failures):
+					writeConn.send(("msg", msg))
+				writeConn.send(("done", None))
+			except BaseException as e: # including SystemExit, which must not get back into the worker loop
+				try:
+					writeConn.send(("error", type(e).__name__ + ": " + str(e)))
+				except BaseException:
+					pass
+			finally:
+				os._exit(0)
+		writeConn.close()
+		child = pid
+		return readConn, pid
+
+	def run(self, job, start, timeouts, failures, timerTime):
+		"""Relays everything a submission's job yields, giving each message timerTime seconds.
+			The first message says whether the code loaded; the rest are TestOutcome frames.
+			start is a position in the zygote's test order, not a test index."""
+		loaded = False
+		while True:
+			conn, pid = self.fork(job, start, timeouts, failures)
+			childLoaded = False
+			problem = None # how the child went wrong, if it did
+			abandoned = False # whether the child gave up on student code that wouldn't stop
+			while True:
+				timer = Timer(timerTime)
+				if not conn.poll(timer.remaining()):
+					problem = "Infinite loop! Code timed out after " + str(timerTime) + " seconds"
+					break
+				try:
+					kind, payload = conn.recv()
+				except (EOFError, OSError):
+					problem = "Broken Process"
+					break
+				if kind == "done":
+					break
+				elif kind == "abandoned":
+					abandoned = True
+					break
+				elif kind == "error":
+					log("zygote\trun\tJob broke: " + str(payload), "bug")
+					problem = "Broken Process"
+					break
+				elif not childLoaded:
+					childLoaded = True
+					if not loaded:
+						loaded = True
+						yield payload
+					if payload != "loaded":
+						break
+				else:
+					outcome = TestOutcome.fromFrame(payload)
+					if outcome.timedOut():
+						timeouts += 1
+					if not outcome.passed():
+						failures += 1
+					start = self.positions[outcome.index] + 1
+					yield payload
+			stopChild(pid, problem != None)
+			conn.close()
+
+			if abandoned and start < len(self.tests):
+				continue # its last test is already reported, so carry on with the next one
+			if problem == None:
+				return
+			if not childLoaded:
+				if not loaded:
+					yield problem
+				return
+			if start >= len(self.tests):
+				return
+			# Report the test that broke, then carry on with the next one in a fresh child
+			i = self.order[start]
+			outcome = TestOutcome(i, BROKEN, input=self.inputReprs[i], message=problem, elapsed=timer.elapsed())
+			yield outcome.frame()
+			start += 1
+			if outcome.timedOut(): # a crash doesn't count towards skipping the rest
+				timeouts += 1
+			failures += 1
+			if start >= len(self.tests):
+				return
+
+	def abandon(self, msg):
+		"""Only call this in a child! Reports msg as if the job had yielded it, then ends the child,
+			whatever the student code is in the middle of. The zygote carries on in a fresh child."""
+		childConn.send(("msg", msg))
+		childConn.send(("abandoned", None))
+		os._exit(0)
+
+def stopChild(pid, kill):
+	global child
+	try:
+		if kill:
+			os.kill(pid, signal.SIGKILL)
+		os.waitpid(pid, 0)
+	except OSError as e:
+		log("zygote\tstopChild\tCould not stop child: " + str(e), "bug")
+	child = None
+
+def stopWorker(signum, frame):
+	"""A worker that's being terminated takes its current child with it"""
+	if child != None:
+		try:
+			os.kill(child, signal.SIGKILL)
+		except OSError:
+			pass
+	os._exit(1)
+
+def getZygote(key, payload):
+	"""The zygote for a fixture bundle. The parent only sends the pickled bundle the first time
+		a worker sees its version, and None afterwards."""
+	if key not in zygotes:
+		if payload == None:
+			log("zygote\tgetZygote\tWorker was never sent fixtures " + key, "bug")
+			return None
+		zygotes[key] = Zygote(payload)
+	return zygotes[key]
@@ -1,3 +1,374 @@
-from django.test import TestCase
+import ast, datetime, json, threading, time
+from django.db import transaction
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
 
-# Create your tests here.
+from .models import *
+from .getHint import get_hint, run_tests
+from .hintQueue import enqueue, claim, beat, finish, run, STALE_TIME
+from .views import hint_status
+from . import canonicalCache, problemMetadata, solutionSpace
+from .canonicalize import runGiveIds
+from .unitOfWork import UnitOfWork
+from .individualize import generatePathToId, searchPathToId, treesEdited
+from .astTools import deepcopy
+from .test import fixtures, test
+from .test.workerPool import WorkerPool
+from .test.resultCache import lookupResults, storeResult
+from .test.results import BROKEN, ERROR, PASSED, TIMEOUT
+
+SOLUTION = "def canDrinkAlcohol(age, isDriving):\n    return age >= 21 and not isDriving\n"
+ALMOST = "def canDrinkAlcohol(age, isDriving):\n    return age > 21 and not isDriving\n"
+RENAMED = "def canDrinkAlcohol(a, d):\n    return a > 21 and not d\n"
+SWALLOWS_BUDGET = "def canDrinkAlcohol(age, isDriving):\n    while True:\n        try:\n            pass\n        except:\n            pass\n"
+EXITS = "import sys\ndef canDrinkAlcohol(age, isDriving):\n    sys.exit(1)\n"
+CRASHES_ON_FIRST_TEST = "import os\ndef canDrinkAlcohol(age, isDriving):\n    if age == 22:\n        os._exit(1)\n    return age >= 21 and not isDriving\n"
+LOOPS_WHILE_LOADING = "try:\n    while True:\n        pass\nexcept BaseException:\n    pass\n" + SOLUTION
+
+def echo_job(values):
+    for value in values:
+        yield value
+
+def sleepy_job(seconds):
+    time.sleep(seconds)
+    yield "awake"
+
+def make_problem():
+    """A problem with four tests and a correct solution, along with the course's first student"""
+    course = Course(name="c", year=2017)
+    course.save()
+    student = Student(course=course, name="admin")
+    student.save()
+    problem = Problem(name="canDrinkAlcohol", arguments="{ 'canDrinkAlcohol' : ['int', 'bool'] }", given_code="")
+    problem.save()
+    problem.courses.add(course)
+    for (i, o) in [("(22, True)", "False"), ("(20, False)", "False"), ("(21, False)", "True"), ("(30, False)", "True")]:
+        Testcase(problem=problem, test_input=i, test_output=o).save()
+    run_tests(SourceState(code=SOLUTION, problem=problem, count=1, student=student))
+    return problem, student
+
+def clear_caches():
+    """Drops everything this process remembers about problems, so the next request starts cold"""
+    solutionSpace.spaces.clear()
+    canonicalCache.canonical_forms.clear()
+    fixtures.bundles.clear()
+    problemMetadata.metadata.clear()
+
+def hint_fields(s):
+    return (s.score, s.hint.message, s.hint.level, s.hint.line, s.hint.col)
+
+class HintTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.problem, self.student = make_problem()
+
+    def tearDown(self):
+        clear_caches()
+
+    def submit(self, code, name):
+        student = Student(course=self.student.course, name=name)
+        student.save()
+        return get_hint(SourceState(code=code, problem=self.problem, count=1, student=student), hint_level="next_step")
+
+    def test_repeated_submission_matches_recompute(self):
+        first = self.submit(ALMOST, "a")
+        # The repeat runs with everything the first request left in memory...
+        sid = transaction.savepoint()
+        repeat = self.submit(ALMOST, "b")
+        transaction.savepoint_rollback(sid)
+        # ...and again from scratch, against the same database
+        clear_caches()
+        recomputed = self.submit(ALMOST, "b")
+        self.assertEqual(hint_fields(repeat), hint_fields(recomputed))
+        self.assertEqual(first.score, 0.75)
+        self.assertIn("<b>>=</b>", recomputed.hint.message)
+
+    def test_cached_canonical_form_matches_recompute(self):
+        self.submit(ALMOST, "a")
+        forms = len(canonicalCache.canonical_forms)
+        self.assertGreater(forms, 0)
+        sid = transaction.savepoint()
+        cached = self.submit(RENAMED, "b")
+        transaction.savepoint_rollback(sid)
+        self.assertEqual(len(canonicalCache.canonical_forms), forms) # same structure, so the same entry
+        clear_caches()
+        recomputed = self.submit(RENAMED, "b")
+        self.assertEqual(hint_fields(cached), hint_fields(recomputed))
+
+class HintQueueTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.problem, self.student = make_problem()
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        clear_caches()
+
+    def status(self, job, wait):
+        return hint_status(self.factory.get("/hint_status/" + str(job.id) + "/", { "wait" : wait }), job.id)
+
+    def test_status_rejects_waits_that_never_end(self):
+        job = enqueue(self.student, self.problem, ALMOST)
+        for wait in ["nan", "inf", "-inf", "soon"]:
+            self.assertEqual(self.status(job, wait).status_code, 400)
+
+    def test_status_clamps_negative_waits(self):
+        job = enqueue(self.student, self.problem, ALMOST)
+        start = time.time()
+        response = self.status(job, "-5")
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["status"], "queued")
+
+    def age(self, job, seconds):
+        HintJob.objects.filter(id=job.id).update(updated=timezone.now() - datetime.timedelta(seconds=seconds))
+
+    def test_run_finishes_claimed_job(self):
+        job = enqueue(self.student, self.problem, ALMOST)
+        claimed = claim()
+        self.assertEqual(claimed.id, job.id)
+        self.assertIsNone(claim())
+        run(claimed)
+        job = HintJob.objects.get(id=job.id)
+        self.assertEqual(job.status, "done")
+        self.assertIn("hint_message", json.loads(job.result))
+
+    def test_heartbeat_keeps_long_job(self):
+        enqueue(self.student, self.problem, ALMOST)
+        job = claim()
+        self.age(job, STALE_TIME + 1)
+        self.assertTrue(beat(job))
+        self.assertIsNone(claim())
+
+    def test_only_current_claim_finishes_job(self):
+        enqueue(self.student, self.problem, ALMOST)
+        first = claim()
+        self.age(first, STALE_TIME + 1) # its worker stopped beating
+        second = claim()
+        self.assertEqual(second.id, first.id)
+        self.assertNotEqual(second.worker, first.worker)
+        self.assertFalse(beat(first))
+        self.assertFalse(finish(first, "done", "{}"))
+        self.assertTrue(finish(second, "done", "{}"))
+
+class WorkerPoolTests(TestCase):
+    def setUp(self):
+        self.pool = WorkerPool(size=1, maxJobs=2)
+        self.pool.start()
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def run_job(self, f, args, timerTime=1):
+        worker = self.pool.acquire()
+        worker.send(f, args)
+        results = [worker.recv(timerTime)]
+        self.pool.release(worker)
+        return worker, results
+
+    def test_worker_is_reused(self):
+        first, results = self.run_job(echo_job, ([1, 2],))
+        self.assertEqual(results, [("Success", 1)])
+        second, results = self.run_job(echo_job, ([3],))
+        self.assertIs(second, first)
+        self.assertEqual(results, [("Success", 3)])
+
+    def test_worker_is_recycled_after_max_jobs(self):
+        first, results = self.run_job(echo_job, ([1],))
+        self.run_job(echo_job, ([1],))
+        third, results = self.run_job(echo_job, ([1],))
+        self.assertIsNot(third, first)
+
+    def test_slow_job_times_out_and_is_replaced(self):
+        slow, results = self.run_job(sleepy_job, (5,), timerTime=0.2)
+        self.assertTrue(results[0][0].startswith("Infinite loop! Code timed out"))
+        self.assertTrue(slow.broken)
+        self.assertFalse(slow.proc.is_alive())
+        fresh, results = self.run_job(echo_job, ([1],))
+        self.assertIsNot(fresh, slow)
+        self.assertEqual(results, [("Success", 1)])
+
+class ResultCacheTests(TestCase):
+    def test_results_are_kept_per_suite(self):
+        storeResult(SOLUTION, "suite-a", 1, "all passed")
+        storeResult(ALMOST, "suite-a", 0.75, "one failed")
+        found = lookupResults([SOLUTION, ALMOST, "def f():\n    pass\n"], "suite-a")
+        self.assertEqual(sorted(found), sorted([SOLUTION, ALMOST]))
+        self.assertEqual((found[ALMOST].score, found[ALMOST].feedback), (0.75, "one failed"))
+        self.assertEqual(lookupResults([SOLUTION], "suite-b"), { })
+
+    def test_storing_twice_keeps_the_first(self):
+        storeResult(SOLUTION, "suite-a", 1, "all passed")
+        storeResult(SOLUTION, "suite-a", 0, "stored again")
+        self.assertEqual(lookupResults([SOLUTION], "suite-a")[SOLUTION].feedback, "all passed")
+
+class HarnessTestCase(TestCase):
+    """Runs code through the whole test harness: worker pool, zygote and result cache"""
+    def setUp(self):
+        clear_caches()
+        self.problem, self.student = make_problem()
+
+    def tearDown(self):
+        clear_caches()
+
+    def run_code(self, code):
+        s = CanonicalState(code=code, problem=self.problem, count=1)
+        s.tree = None
+        return test(s)
+
+    def is_cached(self, s):
+        return s.code in lookupResults([s.code], fixtures.getBundle(self.problem)[0].version)
+
+class StepBudgetTests(HarnessTestCase):
+    def test_swallowed_budget_still_times_out(self):
+        start = time.time()
+        s = self.run_code(SWALLOWS_BUDGET)
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(s.score, 0)
+        self.assertEqual([outcome.kind for outcome in s.test_results][:2], [TIMEOUT, TIMEOUT])
+        self.assertTrue(self.is_cached(s)) # the budget runs out the same way every time
+
+    def test_swallowed_budget_while_loading(self):
+        s = self.run_code(LOOPS_WHILE_LOADING)
+        self.assertEqual(s.score, 0)
+        self.assertTrue(s.feedback.startswith("Infinite loop! Code ran for more than"))
+        self.assertTrue(self.is_cached(s))
+
+    def test_exit_is_an_error(self):
+        s = self.run_code(EXITS)
+        self.assertEqual([outcome.kind for outcome in s.test_results], [ERROR] * 4)
+        self.assertTrue(self.is_cached(s))
+
+    def test_solution_passes(self):
+        s = self.run_code(SOLUTION)
+        self.assertEqual(s.score, 1)
+        self.assertEqual([outcome.kind for outcome in s.test_results], [PASSED] * 4)
+
+class ZygoteTests(HarnessTestCase):
+    def test_crash_only_breaks_its_own_test(self):
+        s = self.run_code(CRASHES_ON_FIRST_TEST)
+        self.assertEqual([outcome.kind for outcome in s.test_results], [BROKEN, PASSED, PASSED, PASSED])
+        self.assertEqual(s.score, 0.75)
+        self.assertFalse(self.is_cached(s)) # a crashed worker might not crash next time
+
+def numbered_ids(tree):
+    return [node.global_id for node in ast.walk(tree) if hasattr(node, "global_id")]
+
+class IdTests(TestCase):
+    def test_ids_are_dense_per_tree(self):
+        trees = [ast.parse(SOLUTION) for i in range(8)]
+        threads = [threading.Thread(target=runGiveIds, args=(tree,)) for tree in trees]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for tree in trees:
+            ids = sorted(numbered_ids(tree))
+            self.assertEqual(ids, list(range(ids[0], ids[0] + len(ids))))
+
+    def test_id_table_sees_edits(self):
+        tree = ast.parse("def f(x):\n    y = x\n    return y\n")
+        runGiveIds(tree)
+        ret = tree.body[0].body[1]
+        self.assertEqual(generatePathToId(tree, ret.global_id), searchPathToId(tree, ret.global_id))
+        tree.body[0].body[0] = deepcopy(ret) # an earlier node with the same id, which doesn't move ret
+        treesEdited()
+        self.assertEqual(generatePathToId(tree, ret.global_id), searchPathToId(tree, ret.global_id))
+
+class FixtureTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.problem, self.student = make_problem()
+
+    def tearDown(self):
+        clear_caches()
+
+    def test_bundle_checked_once_per_instance(self):
+        problem = Problem.objects.get(id=self.problem.id)
+        bundle, msg = fixtures.getBundle(problem)
+        with self.assertNumQueries(0):
+            self.assertIs(fixtures.getBundle(problem)[0], bundle)
+
+    def test_bundle_sees_edits_from_other_processes(self):
+        bundle, msg = fixtures.getBundle(Problem.objects.get(id=self.problem.id))
+        # update() doesn't send signals, just like an edit made by another process
+        Testcase.objects.filter(problem=self.problem, test_input="(30, False)").update(test_output="False")
+        problem = Problem.objects.get(id=self.problem.id)
+        edited, msg = fixtures.getBundle(problem)
+        self.assertNotEqual(edited.version, bundle.version)
+        self.assertIn(False, [output for (input, output, extra) in edited.tests if input == (30, False)])
+
+    def test_local_edit_drops_bundle(self):
+        problem = Problem.objects.get(id=self.problem.id)
+        bundle, msg = fixtures.getBundle(problem)
+        Testcase(problem=self.problem, test_input="(40, True)", test_output="False").save()
+        self.assertEqual(len(fixtures.getBundle(problem)[0]), 5)
+
+class SolutionSpaceTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.problem, self.student = make_problem()
+
+    def tearDown(self):
+        clear_caches()
+
+    def anon(self, code):
+        state = AnonState(code=code, problem=self.problem, score=1)
+        state.save()
+        return state
+
+    def elsewhere(self, action):
+        """Runs action the way another process would, without this process's space hearing about it"""
+        space = solutionSpace.spaces.pop(self.problem.id)
+        try:
+            return action()
+        finally:
+            solutionSpace.spaces[self.problem.id] = space
+
+    def ids_with_code(self, code):
+        return [state.id for state in solutionSpace.getSpace(self.problem).withCode(AnonState, code)]
+
+    def test_unchanged_space_reads_only_the_version(self):
+        solutionSpace.getSpace(self.problem)
+        with self.assertNumQueries(1):
+            solutionSpace.getSpace(self.problem)
+
+    def test_sees_states_saved_elsewhere(self):
+        self.assertEqual(self.ids_with_code(SOLUTION), [])
+        state = self.elsewhere(lambda : self.anon(SOLUTION))
+        self.assertEqual(self.ids_with_code(SOLUTION), [state.id])
+
+    def test_sees_states_deleted_elsewhere(self):
+        state = self.anon(SOLUTION)
+        self.assertEqual(self.ids_with_code(SOLUTION), [state.id])
+        self.elsewhere(state.delete)
+        self.assertEqual(self.ids_with_code(SOLUTION), [])
+
+class UnitOfWorkTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.problem, self.student = make_problem()
+
+    def tearDown(self):
+        clear_caches()
+
+    def space_version(self):
+        return Problem.objects.get(id=self.problem.id).space_version
+
+    def test_unit_stamps_states_with_one_version(self):
+        before = self.space_version()
+        with UnitOfWork() as work:
+            anon = AnonState(code=ALMOST, problem=self.problem, score=0.75)
+            canonical = CanonicalState(code=ALMOST, problem=self.problem, score=0.75)
+            anon.canonical = canonical
+            work.add(anon, canonical)
+        self.assertEqual(self.space_version(), before + 1)
+        self.assertEqual((anon.space_version, canonical.space_version), (before + 1, before + 1))
+        self.assertEqual(AnonState.objects.get(id=anon.id).canonical_id, canonical.id)
+
+    def test_unchanged_states_are_not_saved(self):
+        anon = AnonState(code=ALMOST, problem=self.problem, score=0.75)
+        anon.save()
+        before = self.space_version()
+        with UnitOfWork() as work:
+            work.add(AnonState.objects.get(id=anon.id))
+        self.assertEqual(self.space_version(), before)
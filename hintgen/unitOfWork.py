@@ -0,0 +1,81 @@
+"""Saves everything a hint request touched in one transaction. Objects are added to a unit of
+work as they're found, and when the block ends, each one is saved after the objects it points
+to, and only if it changed. All the anon/canonical states the unit changes share one new
+space_version, instead of bumping the problem's counter once per save."""
+import sys, threading
+from django.db import transaction
+from django.db.models import F
+from .models import Problem
+
+current = threading.local()
+
+def currentWork():
+	return getattr(current, "work", None)
+
+def relatedObjects(obj):
+	"""The (field, object) pairs for the foreign keys that have an object assigned"""
+	related = []
+	for field in obj._meta.concrete_fields:
+		if field.is_relation:
+			try:
+				target = getattr(obj, field.get_cache_name())
+			except AttributeError:
+				continue
+			if target != None:
+				related.append((field, target))
+	return related
+
+class UnitOfWork:
+	def __init__(self):
+		self.pending = [] # objects to save, in the order they were added
+		self.versions = { } # problem id -> the space_version this unit stamps states with
+
+	def add(self, *objects):
+		for obj in objects:
+			if obj != None and not any(obj is other for other in self.pending):
+				self.pending.append(obj)
+
+	def spaceVersion(self, problem_id):
+		if problem_id not in self.versions:
+			problems = Problem.objects.filter(id=problem_id)
+			problems.update(space_version=F("space_version") + 1)
+			self.versions[problem_id] = problems.values_list("space_version", flat=True)[0]
+		return self.versions[problem_id]
+
+	def __enter__(self):
+		self.atomic = transaction.atomic()
+		self.atomic.__enter__()
+		self.outer = currentWork()
+		current.work = self
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		if excType == None:
+			try:
+				self.flush()
+			except:
+				# Any error in the flush rolls the whole unit back
+				current.work = self.outer
+				self.atomic.__exit__(*sys.exc_info())
+				raise
+		current.work = self.outer
+		return self.atomic.__exit__(excType, excValue, traceback)
+
+	def flush(self):
+		done = [] # objects already handled, by identity
+		for obj in self.pending:
+			self.save(obj, done)
+
+	def save(self, obj, done):
+		if any(obj is other for other in done):
+			return
+		done.append(obj)
+		for (field, target) in relatedObjects(obj):
+			# Unsaved objects have to be saved first, whether or not they were added
+			if target.pk == None or any(target is other for other in self.pending):
+				self.save(target, done)
+			setattr(obj, field.name, target) # picks up the id of a just-saved object
+		if not hasattr(obj, "changed") or obj.changed():
+			obj.save()
+			if hasattr(obj, "remember_values"):
+				obj.remember_values()
@@ -6,4 +6,6 @@ urlpatterns = [
     url(r'^$', views.index, name='index'),
     url(r'^feedback/([0-9]+)/([0-9]+)/$', views.feedback, name="feedback"),
     url(r'^hint/([0-9]+)/([0-9]+)/$', views.hint, name="hint"),
+    url(r'^hint_status/([0-9]+)/$', views.hint_status, name="hint_status"),
+    url(r'^hint_timings/$', views.hint_timings, name="hint_timings"),
 ]
\ No newline at end of file
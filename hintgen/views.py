@@ -1,8 +1,10 @@
 from django.shortcuts import render
 from django.http import HttpResponse, HttpResponseBadRequest
-import json, random
+import json, math, random
 from hintgen.models import *
-from hintgen.getHint import get_hint, run_tests
+from hintgen.getHint import run_tests, hint_response
+from hintgen.hintQueue import enqueue, wait_for
+from hintgen import stageTimer
 
 """
 TESTING
@@ -18,6 +20,7 @@ response = c.post('/hintgen/hint/' + str(course_id) + '/' + str(problem_id) + '/
 
 
 RUNNING_STUDY = False
+MAX_HINT_WAIT = 30 # the longest a hint_status request will wait for its job
 
 # Create your views here.
 def index(request):
@@ -211,6 +214,9 @@ In the url, map:
 In the request content, include a json object mapping:
     student_id -> the student ID for this submission
     code -> the code being submitted
+    async -> optional. if "true", the hint is generated by a hint_worker process instead, and the
+             response is a json object mapping job_id to the ID to poll with hint_status.
+             Jobs stay queued until a worker is running (python run_command.py hint_worker).
 
 RETURNS
 A json object mapping:
@@ -225,9 +231,7 @@ def hint(request, course_id, problem_id):
     if isinstance(data, HttpResponse):
         return data
 
-    code_state = SourceState(code=data["code"], problem=data["problem"], 
-                             student=data["student"], count=1)
-
+    kind = "hint"
     if RUNNING_STUDY:
         # Some terrible hard coding for the Spring '17 study. Sorry!
         first_half = [ "has_two_digits", "is_leap_month", "wear_a_coat", 
@@ -236,24 +240,64 @@ def hint(request, course_id, problem_id):
         second_half = [ "was_lincoln_alive", "get_extra_bagel", "go_to_gym", 
                         "one_to_n", "reduce_to_positive", "any_first_chars",
                         "second_largest", "last_index" ]
-        if (data["problem"].name in first_half and data["student"].condition == "hints_first") or \
-            (data["problem"].name in second_half and data["student"].condition == "hints_second"):
-            code_state = get_hint(code_state)
-            hint_message = code_state.hint.message.replace("\n", "<br>").replace("    ", "&nbsp;&nbsp;&nbsp;&nbsp;").replace("\t", "&nbsp;&nbsp;&nbsp;&nbsp;").replace("  ", "&nbsp;&nbsp;")
-            result_object = { "hint_message" : hint_message, "line" : code_state.hint.line,
-                              "col" : code_state.hint.col, "hint_type" : code_state.hint.level }
-        else:
-            code_state = run_tests(code_state)
-            test_results = code_state.feedback.replace("\n", "<br>").replace("    ", "&nbsp;&nbsp;&nbsp;&nbsp;").replace("\t", "&nbsp;&nbsp;&nbsp;&nbsp;").replace("  ", "&nbsp;&nbsp;")
-            result_object = { "hint_message" : "Here's the test case results:<br>" + test_results, 
-                              "line" : 1, "col" : 1, "hint_type" : "feedback" }
-    else:
-        code_state = get_hint(code_state)
-        hint_message = code_state.hint.message.replace("\n", "<br>").replace("    ", "&nbsp;&nbsp;&nbsp;&nbsp;").replace("\t", "&nbsp;&nbsp;&nbsp;&nbsp;").replace("  ", "&nbsp;&nbsp;")
-        result_object = { "hint_message" : hint_message, "line" : code_state.hint.line,
-                          "col" : code_state.hint.col, "hint_type" : code_state.hint.level }
+        if not ((data["problem"].name in first_half and data["student"].condition == "hints_first") or \
+            (data["problem"].name in second_half and data["student"].condition == "hints_second")):
+            kind = "feedback"
+
+    if data.get("async") in ["true", "True", "1"]:
+        # Only hint_worker processes run the job, see run_command.py
+        job = enqueue(data["student"], data["problem"], data["code"], kind)
+        return HttpResponse(json.dumps({ "job_id" : job.id }), status=202)
+
+    code_state = SourceState(code=data["code"], problem=data["problem"], 
+                             student=data["student"], count=1)
+    result_object = hint_response(code_state, kind)
+    return HttpResponse(json.dumps(result_object))
+
+"""
+Check on a hint job that was started with async.
+
+USAGE
+In the url, map:
+    job_id -> the job ID the hint view returned
+In the query string, optionally include:
+    wait -> the number of seconds (up to 30) to wait for the job to finish before answering
+
+RETURNS
+A json object mapping:
+    status -> "queued", "running", "done", or "failed"
+When the status is "done", the object also includes everything the hint view returns.
+"""
+def hint_status(request, job_id):
+    try:
+        wait = float(request.GET.get("wait", 0))
+    except ValueError:
+        wait = None
+    if wait == None or not math.isfinite(wait): # nan would never stop waiting
+        return HttpResponseBadRequest("wait should be a number of seconds")
+    wait = max(0, min(wait, MAX_HINT_WAIT))
+    if not HintJob.objects.filter(id=job_id).exists():
+        return HttpResponseBadRequest("No hint job exists with that ID")
+
+    job = wait_for(job_id, wait)
+    result_object = json.loads(job.result) if job.result != "" else { }
+    result_object["status"] = job.status
     return HttpResponse(json.dumps(result_object))
 
+"""
+Report how long each stage of hint generation has taken in this server process.
+
+RETURNS
+A json object mapping each problem ID to an object mapping each stage (parse, test,
+generate_cleaned_state, ..., save_states, and total) to:
+    count -> the number of requests that ran the stage
+    total -> the total seconds spent in the stage
+    buckets -> a histogram of the stage's time per request, in seconds
+Hints run by hint_worker processes are written to the timing log instead.
+"""
+def hint_timings(request):
+    return HttpResponse(json.dumps(stageTimer.report()))
+
 def unpack_problem_json(request):
     data = json.loads(request.body.decode('utf-8'))
     if "name" not in data:
@@ -288,6 +332,7 @@ Request data should be a json object which includes the maps:
     solution_code -> a string containing a code solution to the problem. Must pass all the given test cases!
     arguments -> optional. a dictionary that maps function names to lists of the argument types they expect (represented as strings). If the argument type can vary, it can be represented with "None"
     given_code -> optional. a string containing given code that is provided and should be included when testing a student's submission.
+    step_budget -> optional. the number of lines/calls a submission may execute while loading, and again while running each test, before it counts as an infinite loop.
 
 RETURNS
 A json object mapping:
@@ -308,6 +353,9 @@ def setup_problem(request):
     if "given_code" in data:
         problem.given_code = data["given_code"]
 
+    if "step_budget" in data:
+        problem.step_budget = int(data["step_budget"])
+
     problem.courses.add(*data["courses"])
     problem.save()
 
@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+"""Runs one of hintgen's management commands. manage.py runs hintgen/offline_test.py instead
+of Django's command line, so start the hint workers and the benchmark with this instead:
+    python run_command.py hint_worker --processes 4
+    python run_command.py hint_benchmark --processes 4 --limit 50
+"""
+import os
+import sys
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "testsite.settings")
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python run_command.py <command> [options]")
+    import django
+    django.setup()
+    from django.core.management import call_command
+    call_command(sys.argv[1], *sys.argv[2:])